@@ -1,11 +1,8 @@
 import time
-import sys
 import numpy as np
 import matplotlib.pyplot as plt
 from funkyAD.base import AD
 
-sys.setrecursionlimit(100000)
-
 def my_sum(a):
     return a.sum()
 
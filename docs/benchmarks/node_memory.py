@@ -0,0 +1,52 @@
+import time
+import tracemalloc
+import numpy as np
+from funkyAD.base import AD, Node
+from funkyAD.functions import addition
+
+# Per-node memory and construction time of the evaluation graph.
+# Measured on 100000 nodes, best of 5, range over 3 runs (python 3.11.7, numpy 1.26.4).
+# "before" is this script run against the commit preceding the __slots__ change, with the
+# "without validation" line removed since Node has no check argument there.
+#
+#                                      before __slots__    after __slots__
+#   Node(x, d) with validation           1.4 - 1.9 us        1.5 - 2.1 us
+#   Node(x, d) without validation            -               0.5 - 0.9 us
+#   node created by addition(x, y)       4.7 - 6.5 us        3.6 - 4.3 us
+#   memory per node (incl. float value)     136 B               96 B
+#   AD(sum).grad over 2000 inputs          0.07 s              0.07 s
+#
+# Validating a Node costs the same as before; the gain comes from Nodes created inside the
+# graph (by BaseFunctions) skipping validation, and from the smaller slotted objects.
+
+N = 100000
+
+def construction_time(make, repeat=5):
+    # Best of several runs, per node
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for i in range(N):
+            make(i)
+        times.append(time.perf_counter() - start_time)
+    return min(times) / N
+
+def memory_per_node(make):
+    tracemalloc.start()
+    nodes = [make(i) for i in range(N)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Remove the list holding the nodes (the float values are included)
+    return (size - 8 * len(nodes)) / N
+
+x, y = Node(1.0, 1.0), Node(2.0, 0.0)
+print('Node(x, d) with validation:    %.2f us' % (1e6 * construction_time(lambda i: Node(float(i), 1.0))))
+print('Node(x, d) without validation: %.2f us'
+      % (1e6 * construction_time(lambda i: Node(float(i), 1.0, check=False))))
+print('node created by addition:      %.2f us' % (1e6 * construction_time(lambda i: addition(x, y))))
+print('memory per node:               %d B' % memory_per_node(lambda i: Node(float(i), 1.0)))
+
+inp = np.arange(2000.)
+start_time = time.perf_counter()
+AD(lambda a: a.sum()).grad(inp)
+print('AD(sum).grad over 2000 inputs: %.2f s' % (time.perf_counter() - start_time))
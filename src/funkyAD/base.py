@@ -1,6 +1,34 @@
+import operator
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import numpy as np
-from .functions import addition, multiplication, division, power, pos, neg, _abs, invert, floordiv, _round, floor, ceil, trunc
-from .helpers import count_recursive, nodify, unpack, recursive_append
+from .functions import addition, multiplication, division, power, pos, neg, _abs, invert, floordiv, _round, floor, ceil, trunc, index, _sum
+from .functions import exp, log, sqrt, sin, cos, tan, arcsin, arccos, arctan, sinh, cosh, tanh, value
+from .functions import subtraction, _prod, _matmul, stack
+from .helpers import check_numeric, count_recursive, nodify, unpack, flat_args, input_structure
+from .tape import Tape, current_tape
+from .compiler import compile_tape, Retrace
+from .checkpoint import checkpoint
+from .sparsity import jacobian_sparsity, hessian_sparsity, color_columns, compression_seed, to_sparse
+from .cache import LRUCache, array_key
+from .optimizer import optimize_tape
+from .incremental import IncrementalTape
+
+class _PerThread():
+    '''AD attribute describing the current call (n, m, the Nodes, the tape...) rather than
+    the AD object. Stored per thread, so that several threads can call one AD object.'''
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return getattr(obj._calls, self.name, None)
+
+    def __set__(self, obj, value):
+        setattr(obj._calls, self.name, value)
 
 class AD():
     '''Wraps a function to access Automatic Differentiation methods.
@@ -23,35 +51,395 @@ class AD():
             return exp(x)
     >>> print(AD(f).grad(0))
     [[1]]
+
+    AD(f, validate=False)
+    -   skips verifying that the inputs are numeric. Faster for large inputs that are
+        already known to be valid.
+
+    AD(f, vectorize=True)
+    -   passes each np.array argument to f as a single Node holding the whole array, rather
+        than as an array of one Node per element. Functions then run elementwise in numpy
+        (x * y, sin(x), ...), and x[i] and x.sum() are single operations. Array valued
+        outputs count as one output per element.
+
+    AD(f, replay=True)
+    -   records f on a Tape the first time grad is called and, on later calls with inputs
+        of the same structure, re-evaluates the tape at the new inputs instead of running f
+        again. Comparisons between Nodes (x < y, ...) are recorded: if one would now give
+        a different result, f is recorded again. Branches on plain values (e.g. x.v > 0)
+        cannot be detected. The gradient is computed with a reverse sweep of the tape.
+
+    AD(f, compile=True)
+    -   like replay=True, but the recorded tape is also compiled to a plain Python function
+        computing the Jacobian with straight-line numpy statements (see compiler.py), cached
+        per input structure. Falls back to the reverse sweep when the tape uses functions
+        that cannot be compiled (e.g. abs, floor) or holds array valued Nodes.
+
+    AD(f, chunk_size=64)
+    -   in forward mode, computes the Jacobian in blocks of at most 64 columns: f is
+        evaluated once per block, seeded with only these columns of the identity, so each
+        Node derivative holds at most 64 values instead of one per input. Bounds memory for
+        functions of many inputs. Not used when a seed was set with set_seed.
+
+    AD(f, processes=4)
+    -   splits the columns (forward mode) or rows (reverse mode) of the Jacobian between
+        4 worker processes, each evaluating f on its block of seeds. f and the arguments are
+        sent to the workers, so they must be picklable: f must be defined at module level
+        (not a lambda). Starting the processes takes time, so this only pays off for wide
+        Jacobians of expensive functions. Not used with replay, compile or set_seed.
+
+    AD(f, retain_graph=True)
+    -   keeps the graph of the last reverse mode grad call: input_nodes and output_nodes
+        (with the back-gradient of each input in back_g) and the recorded tape. By default
+        the Nodes are dropped once recorded and each back-gradient as soon as it has been
+        propagated, so large graphs are not kept in memory after grad returns.
+
+    AD(f, optimize=True)
+    -   simplifies every recorded tape (replay, compile, reverse mode, second order...)
+        before it is used: operations of constants only are folded into constants, repeated
+        operations on the same arguments are merged, and operations the outputs do not
+        depend on are dropped (see optimizer.py). adobj.optimization reports how many slots
+        each of these removed from the last tape.
+
+    AD(f, incremental=True)
+    -   records f on a Tape the first time grad is called, with the partial derivative of
+        every operation. On later calls with inputs of the same structure, only the
+        operations that depend on an input whose value changed are evaluated again, and
+        the Jacobian is accumulated from the stored partials (see incremental.py). Pays off
+        when few inputs change between calls, e.g. in coordinate descent. Comparisons are
+        checked as with replay=True. Needs scalar Nodes (not vectorize=True); the mode and
+        seed are not used.
+
+    AD(f, cache_size=128)
+    -   keeps the Jacobians computed by grad at the last 128 distinct arguments (same values,
+        shapes and types), with the mode and seed they were computed with. grad at the same
+        arguments again returns a copy of the stored Jacobian without evaluating f: only n
+        and m are then updated, not input_nodes, output_nodes or tape. f must not depend on
+        anything else than its arguments. adobj.cache.info() gives the hits, misses and
+        evictions so far.
+
+    AD.checkpoint(fn)
+    -   wraps a function called inside f, e.g. a block of time steps, so that reverse mode
+        only keeps its inputs and outputs and recomputes the operations inside it during
+        the reverse sweep:
+    >>> step = AD.checkpoint(lambda x: [x[0] + 0.1 * x[1], x[1] - 0.1 * sin(x[0])])
+
+    AD objects can be shared between threads: the state of a call (n, m, input_nodes,
+    output_nodes, tape...) is kept per thread, and temporary seeds only apply to the
+    thread that sets them. The attributes hold the results of the last call of the thread
+    reading them.
     '''
 
-    def __init__(self, f):
+    # Wraps a function used inside f, so that reverse mode recomputes it rather than
+    # keeping the operations inside it (see checkpoint.py)
+    checkpoint = staticmethod(checkpoint)
+
+    n = _PerThread()
+    m = _PerThread()
+    tape = _PerThread()
+    input_nodes = _PerThread()
+    output_nodes = _PerThread()
+    back_seed = _PerThread()
+    optimization = _PerThread()
+    # Tape kept by replay=True and its input structure (self.tape is the last recorded
+    # one, e.g. by hessian or vjp)
+    _replay_tape = _PerThread()
+    _tape_key = _PerThread()
+    # State of incremental=True (see incremental.py) and its input structure
+    _incremental = _PerThread()
+    _incremental_key = _PerThread()
+
+    def __init__(self, f, validate=True, vectorize=False, replay=False, compile=False,
+                 chunk_size=None, processes=None, retain_graph=False, cache_size=None,
+                 optimize=False, incremental=False):
         if not callable(f):
             raise TypeError('The input function to AD must be callable')
+        self._calls = threading.local()
+        # Guards the caches shared by all threads (_compiled, _modes)
+        self._lock = threading.Lock()
         self.f = f
+        self.validate = validate
+        self.vectorize = vectorize
+        self.replay = replay
+        self.compile = compile
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        self.chunk_size = chunk_size
+        if processes is not None and processes < 1:
+            raise ValueError('processes must be a positive integer')
+        self.processes = processes
+        self.retain_graph = retain_graph
+        self.optimize = optimize
+        self.incremental = incremental
+        # Jacobians by arguments, mode and seed (see cache.py)
+        self.cache = LRUCache(cache_size) if cache_size is not None else None
+        # Compiled tapes by input structure (None when the tape cannot be compiled)
+        self._compiled = {}
         self.seed = None
-        self.n = None
-        self.m = None
-        self.trace = None
         self.mode = 'forward'
+        # Modes chosen in "auto" mode, by input structure
+        self._modes = {}
 
     def set_mode(self, mode):
-        if mode not in ('forward','reverse'):
-            raise ValueError('Invalid mode = Only "forward" and "reverse" mode are supported')
+        '''Sets the mode used by grad: "forward", "reverse" or "auto".
+
+        In "auto" mode the function is recorded once per input structure to count its inputs
+        n and outputs m, and grad uses reverse mode when m < n, forward mode (chunked if
+        chunk_size is set) otherwise. The choice is cached per input structure.
+        '''
+        if mode not in ('forward','reverse','auto'):
+            raise ValueError('Invalid mode = Only "forward", "reverse" and "auto" mode are supported')
         else:
             self.mode = mode
 
     def grad(self, *args):
         '''Returns the gradient of the function evaluated on the arguments given'''
-        if self.mode not in ('forward','reverse'):
-            raise ValueError('Invalid mode = Only "forward" and "reverse" mode are supported')
-        if self.mode=='forward':
+        if self.mode not in ('forward','reverse','auto'):
+            raise ValueError('Invalid mode = Only "forward", "reverse" and "auto" mode are supported')
+        if self.cache is None:
+            return self._grad(*args)
+        key = array_key(*args)
+        if key is None:
+            return self._grad(*args)
+        key = (key, self.mode, array_key(self.seed))
+        hit = self.cache.get(key)
+        if hit is not None:
+            jacobian, self.m, self.n = hit
+            return jacobian.copy()
+        jacobian = self._grad(*args)
+        self.cache.put(key, (jacobian.copy(), self.m, self.n))
+        return jacobian
+
+    def _grad(self, *args):
+        if self.compile:
+            return self._compiled_grad(*args)
+        if self.incremental:
+            return self._incremental_grad(*args)
+        if self.replay:
+            return self._replay(*args)
+        mode = self._auto_mode(*args) if self.mode == 'auto' else self.mode
+        if self.processes is not None and self.seed is None:
+            return self._parallel_grad(mode, *args)
+        if mode == 'forward' and self.chunk_size is not None and self.seed is None:
+            return self._chunked_forward(*args)
+        if mode=='forward':
             out_nodes = self._forward(*args)
-            return np.array([node.d for node in unpack(out_nodes)])
-        elif self.mode == 'reverse':
-            out_nodes = self._reverse(*args)
+            return self._jacobian_rows(unpack(out_nodes), np.shape(self.seed)[1:] if self.seed is not None else (self.n,))
+        elif mode == 'reverse':
+            out_nodes = self._reverse(*args, retain_graph=self.retain_graph)
             return out_nodes
 
+    def grad_batch(self, *args):
+        '''Returns the gradients of the function at B points at once, stacked.
+
+        Each argument has a leading batch axis of length B: a scalar argument of the function
+        is given as an array of shape (B,), an array argument of length k as an array of
+        shape (B, k). The function runs once, in forward mode, on Nodes holding the values of
+        all points along the batch axis, so every operation runs once over the whole batch.
+        Returns an array of shape (B, m, n), the Jacobian at each point.
+
+        The function must not branch on comparisons between Nodes, as these compare whole
+        batches. Not available with vectorize=True.
+        '''
+        if self.vectorize:
+            raise ValueError('grad_batch is not supported with vectorize=True')
+        if self.validate:
+            check_numeric(*args)
+        args = [np.asarray(a, dtype=np.float64) for a in args]
+        if any(a.ndim not in (1, 2) for a in args):
+            raise ValueError('grad_batch arguments must have shape (B,) or (B, k)')
+        B = len(args[0]) if args else 0
+        if any(len(a) != B for a in args):
+            raise ValueError('All grad_batch arguments must have the same batch size')
+
+        self.n = sum(1 if a.ndim == 1 else a.shape[1] for a in args)
+        if self.seed is not None:
+            self._check_seed(self.n)
+            seed = self.seed
+        else:
+            seed = np.eye(self.n)
+
+        # One Node per input, holding its values at all points; each derivative has shape
+        # seed_width + (B,)
+        ones = np.ones(B)
+        seeds = iter(seed)
+        new_args = []
+        for a in args:
+            if a.ndim == 1:
+                new_args.append(Node(a, np.multiply.outer(next(seeds), ones), check=False))
+            else:
+                new_args.append(np.array([Node(column, np.multiply.outer(next(seeds), ones), check=False)
+                                          for column in a.T]))
+        self.input_nodes = new_args
+
+        try:
+            out = self.f(*new_args)
+        except TypeError as e:
+            raise TypeError('function and *args are not callable') from e
+        self.output_nodes = self._outputs(out)
+        self.m = len(self.output_nodes)
+
+        # (m, seed_width, B), batch axis first
+        shape = np.shape(seed)[1:] + (B,)
+        rows = [np.broadcast_to(node.d, shape) for node in self.output_nodes]
+        return np.moveaxis(np.array(rows), -1, 0)
+
+    def jvp(self, args, v):
+        '''Returns the Jacobian-vector product J @ v without computing J.
+
+        args: tuple of the arguments of the function, as given to grad.
+        v: vector of n values, one per input (in the order of the flattened arguments).
+        Runs a single forward pass with v as the seed, whatever the number of inputs.
+        '''
+        n = count_recursive(tuple(args))
+        if self.validate:
+            check_numeric(v)
+        v = np.asarray(v, dtype=np.float64)
+        if v.shape != (n,):
+            raise ValueError('v must have one value per input')
+        with self._seeded(v):
+            out_nodes = self._forward(*args)
+        return self._jacobian_rows(unpack(out_nodes), ())
+
+    def vjp(self, args, u):
+        '''Returns the vector-Jacobian product u @ J without computing J.
+
+        args: tuple of the arguments of the function, as given to grad.
+        u: vector of m values, one per output.
+        Runs a single reverse sweep with u as the back-gradient of the outputs, whatever the
+        number of outputs.
+        '''
+        if self.validate:
+            check_numeric(u)
+        u = np.asarray(u, dtype=np.float64)
+        tape = self._record(*args)
+        m = sum(np.size(tape.values[i]) for i in tape.outputs)
+        if u.shape != (m,):
+            raise ValueError('u must have one value per output')
+        return self._sweep(tape, u.reshape(1, m))[0][0]
+
+    def hvp(self, args, v):
+        '''Returns the Hessian-vector product H @ v of a function with a single output.
+
+        args: tuple of the arguments of the function, as given to grad.
+        v: vector of n values, one per input.
+        Forward over reverse: the recorded tape is evaluated on Nodes carrying derivatives
+        along v, then swept in reverse. The back-gradients are then Nodes as well, whose
+        derivatives are H @ v. Costs a small multiple of one reverse mode gradient.
+        '''
+        if self.validate:
+            check_numeric(v)
+        v = np.asarray(v, dtype=np.float64)
+        tape = self._second_order_tape(args)
+        if v.shape != (len(tape.inputs),):
+            raise ValueError('v must have one value per input')
+        return self._second_order(tape, v, ())
+
+    def hessian(self, *args):
+        '''Returns the (n, n) Hessian of a function with a single output.
+
+        Computed forward over reverse as hvp, for all columns at once. Inputs that never
+        appear together in a nonlinear operation share a column, so only as many columns
+        as colors of the Hessian sparsity pattern are carried (see sparsity.py).
+        '''
+        tape = self._second_order_tape(args)
+        n = len(tape.inputs)
+        rows, cols = hessian_sparsity(tape)
+        hessian = np.zeros((n, n))
+        if len(rows) == 0:
+            return hessian
+        colors = color_columns(rows, cols, n)
+        seed = compression_seed(colors)
+        compressed = self._second_order(tape, seed, seed.shape[1:])
+        hessian[rows, cols] = compressed[rows, colors[cols]]
+        # Symmetric up to rounding
+        return (hessian + hessian.T) / 2
+
+    def taylor(self, args, v, order):
+        '''Returns the derivatives of order 0 to order of t -> f(args + t * v) at t = 0.
+
+        args: tuple of the arguments of the function, as given to grad.
+        v: direction, one value per input.
+        Returns an (m, order + 1) array, column k holding the k-th derivatives of the
+        outputs (column 0 the values). The recorded tape is evaluated on truncated Taylor
+        series (see the taylor rules in functions.py), at a cost O(order**2) per operation,
+        rather than by nesting AD order times.
+        '''
+        if self.vectorize:
+            raise ValueError('Taylor mode is not supported with vectorize=True')
+        if self.validate:
+            check_numeric(v)
+        v = np.asarray(v, dtype=np.float64)
+        tape = self._record(*args)
+        if v.shape != (len(tape.inputs),):
+            raise ValueError('v must have one value per input')
+
+        # Inputs x + t * v
+        series = np.zeros((len(v), order + 1))
+        series[:, 0] = tape.values[tape.inputs]
+        if order:
+            series[:, 1] = v
+        values = tape.taylor(series)
+
+        # k-th derivative = k! * k-th coefficient
+        factorials = np.cumprod([1.] + list(range(1, order + 1)))
+        self.m = len(tape.outputs)
+        return np.array([values[i] * factorials for i in tape.outputs])
+
+    def _second_order_tape(self, args):
+        '''Records the function for second order derivatives'''
+        if self.vectorize:
+            raise ValueError('Second order derivatives are not supported with vectorize=True')
+        tape = self._record(*args)
+        if len(tape.outputs) != 1:
+            raise ValueError('Second order derivatives need a function with a single output')
+        return tape
+
+    @staticmethod
+    def _second_order(tape, seed, seed_shape):
+        '''Forward over reverse sweep of a scalar tape: (n,) + seed_shape array of the
+        derivatives of the gradient along each input's seed'''
+        nodes = tape.tangents(seed)
+        adj = tape.reverse([1.0], values=nodes)
+        # Inputs whose back-gradient is not a Node do not affect the gradient
+        return np.array([np.broadcast_to(adj[i].d, seed_shape) if isinstance(adj[i], Node)
+                         else np.zeros(seed_shape) for i in tape.inputs])
+
+    def grad_sparse(self, *args):
+        '''Returns the gradient as a sparse (m, n) matrix, computed with few sweeps.
+
+        The function is recorded once to find which outputs can depend on which inputs.
+        Inputs that never affect the same output share a forward mode seed column (and
+        outputs that never depend on the same input share a reverse mode seed), so the
+        number of derivative columns carried is the number of colors of that grouping
+        rather than n (or m). The cheaper of the two is used.
+
+        Returns a scipy.sparse csr_matrix, or COO triplets (data, (rows, cols)) when scipy
+        is not installed. Not available with vectorize=True.
+        '''
+        if self.vectorize:
+            raise ValueError('grad_sparse is not supported with vectorize=True')
+        tape = self._record(*args)
+        n, m = len(tape.inputs), len(tape.outputs)
+        rows, cols = jacobian_sparsity(tape)
+        column_colors = color_columns(rows, cols, n)
+        row_colors = color_columns(cols, rows, m)
+        self.m = m
+
+        if len(rows) == 0:
+            data = np.zeros(0)
+        elif row_colors.max() < column_colors.max():
+            # Reverse mode: outputs of the same color share a back-gradient seed
+            adj = tape.reverse(list(compression_seed(row_colors)))
+            data = adj[tape.inputs][cols, row_colors[rows]]
+        else:
+            # Forward mode: inputs of the same color share a seed column
+            seed = compression_seed(column_colors)
+            with self._seeded(seed):
+                out_nodes = self._forward(*args)
+            data = self._jacobian_rows(unpack(out_nodes), seed.shape[1:])[rows, column_colors[cols]]
+        return to_sparse(data, rows, cols, (m, n))
+
     def set_seed(self, seed):
         '''Sets a matrix of seed vectors for the forward mode pass.
         If n inputs and m outputs are given, seed argument must have (n, m) shape.
@@ -61,6 +449,27 @@ class AD():
         except: 
             raise ValueError("Seed input must be an array with numeric elements")
 
+    @property
+    def seed(self):
+        '''Seed of the forward mode: the one given to set_seed, unless replaced for the
+        current thread by _seeded'''
+        override = getattr(self._calls, 'seed', None)
+        return self._seed if override is None else override[0]
+
+    @seed.setter
+    def seed(self, seed):
+        self._seed = seed
+
+    @contextmanager
+    def _seeded(self, seed):
+        '''Temporarily replaces the seed, for the current thread only'''
+        previous = getattr(self._calls, 'seed', None)
+        self._calls.seed = (seed,)
+        try:
+            yield
+        finally:
+            self._calls.seed = previous
+
     def _check_seed(self, l):
         '''Checks if provided seed has appropriate dimension'''
         if len(self.seed) != l:
@@ -72,95 +481,301 @@ class AD():
         # Compute number of inputs
         self.n = count_recursive(args)
 
-        # Try to evaluate the function
-        try:
-            output = self.f(*args)
-        except:
-            raise TypeError('function and *args are not callable') 
-            
-        # Compute numer of outputs
-        self.m = count_recursive(output)
-
         # Set seed if not supplied by user
-        if self.seed is not None:
-            default_seed = 0
+        seed = self.seed
+        if seed is not None:
             self._check_seed(self.n)
         else:
-            default_seed = 1
-            self.set_seed(np.eye(self.n)) # identity matrix by default
+            # identity matrix by default (of the type set_seed gives)
+            seed = np.eye(self.n, dtype=np.float32)
 
         # Make all arguments Node objects
-        new_args = nodify(args, self.seed)
+        new_args = nodify(args, seed, self.validate, self.vectorize)
         self.input_nodes = new_args
 
-        if default_seed:
-            # If we assigned a default seed, remove it
-            self.seed = None
-
-        # Replace constants in the output with Node objects
-        out = self.f(*new_args)
-        if hasattr(type(out), '__len__'):
-            self.output_nodes = np.array([a if isinstance(a, Node) else Node(a) for a in out])
-        else:
-            self.output_nodes = np.array([out]) if isinstance(out, Node) else np.array([Node(out)])
-        return self.output_nodes
-
-    def _buildtrace(self, *args):
-        
-        # Store previous seed in a temp value, set seed to 0
-        temp, self.seed = self.seed, [0 for _ in range(count_recursive(args))]
-        out = self._forward(*args)
-        # Put it back
-        self.seed = temp
-
-        trace = []
+        # Evaluate the function once, on the Node objects
+        try:
+            out = self.f(*new_args)
+        except TypeError as e:
+            raise TypeError('function and *args are not callable') from e
 
-        # Nodify 
-        # self._forward will always return an np.array 
-        for a in out:
-            recursive_append(a, trace)
+        self.output_nodes = self._outputs(out)
 
-        self.trace = trace
-        return trace
+        # Compute number of outputs (array valued Nodes count once per element)
+        self.m = sum(np.size(n.v) for n in self.output_nodes)
+        return self.output_nodes
 
-    def _reverse(self, *args):
+    @staticmethod
+    def _outputs(out):
+        '''Array of output Nodes, replacing constants in the output with Node objects'''
+        if hasattr(type(out), '__len__'):
+            return np.array([a if isinstance(a, Node) else Node(a) for a in out])
+        return np.array([out]) if isinstance(out, Node) else np.array([Node(out)])
 
-        trace = self._buildtrace(*args)
 
-        # Set df/dx_n of the output to 1
-        self.back_seed = np.eye(len(self.output_nodes))
-        for i, n in enumerate(self.output_nodes):
-            n.back_g = self.back_seed[i]
-
-        for n in trace:
-            if n.parents:
-                for p in n.parents:
-                    # Set derivative of that node to 1
-                    p.d = 1.0
-                    # Increase the gradient of the parent
-                    p.back_g += n.back_g * n.f.d(*n.parents)
-                    # Put it back so other nodes' computations are not affected
-                    p.d = 0.0
-
-        # Unpack input Node objects in case they are contained in an array or similar
+    def _auto_mode(self, *args):
+        '''Mode used for args in "auto" mode, recording f to count the outputs the first
+        time inputs with this structure are seen'''
+        # A seed only has a meaning in forward mode
+        if self.seed is not None:
+            return 'forward'
+        key = input_structure(args, self.vectorize)
+        mode = self._modes.get(key)
+        if mode is None:
+            tape = self._record(*args)
+            n = sum(np.size(tape.values[i]) for i in tape.inputs)
+            m = sum(np.size(tape.values[i]) for i in tape.outputs)
+            # Every operation carries n derivatives in forward mode (in total over the
+            # chunks), and m back-gradients in reverse mode, which also records the tape
+            mode = 'reverse' if m < n else 'forward'
+            with self._lock:
+                self._modes[key] = mode
+        return mode
+
+    def _chunked_forward(self, *args):
+        '''Forward mode Jacobian assembled from blocks of at most chunk_size columns'''
+        n = count_recursive(args)
+        if n <= self.chunk_size:
+            out_nodes = self._forward(*args)
+            return self._jacobian_rows(unpack(out_nodes), (n,))
+
+        return self._forward_columns(args, n, 0, n)
+
+    def _forward_columns(self, args, n, start, stop):
+        '''Columns start to stop of the forward mode Jacobian, in blocks of at most
+        chunk_size columns'''
+        step = self.chunk_size or stop - start
+        blocks = []
+        for first in range(start, stop, step):
+            width = min(step, stop - first)
+            # Columns first to first + width of the identity
+            seed = np.zeros((n, width))
+            seed[first + np.arange(width), np.arange(width)] = 1
+            with self._seeded(seed):
+                out_nodes = self._forward(*args)
+            blocks.append(self._jacobian_rows(unpack(out_nodes), (width,)))
+        return np.concatenate(blocks, axis=1)
+
+    def _parallel_grad(self, mode, *args):
+        '''Jacobian computed by a pool of processes, each computing a block of columns
+        (forward mode) or rows (reverse mode)'''
+        if mode == 'forward':
+            total = count_recursive(args)
+        else:
+            tape = self._record(*args)
+            total = sum(np.size(tape.values[i]) for i in tape.outputs)
+        bounds = [(b[0], b[-1] + 1) for b in np.array_split(np.arange(total), self.processes) if len(b)]
+
+        with ProcessPoolExecutor(self.processes) as pool:
+            futures = [pool.submit(_jacobian_block, self.f, args, self.validate, self.vectorize,
+                                   self.chunk_size, mode, start, stop) for start, stop in bounds]
+            blocks = [future.result() for future in futures]
+        return np.concatenate(blocks, axis=1 if mode == 'forward' else 0)
+
+    @staticmethod
+    def _jacobian_rows(nodes, seed_shape):
+        '''Stacks the derivatives of the output Nodes, one row per output element'''
+        rows = []
+        for node in nodes:
+            size = np.size(node.v)
+            d = np.broadcast_to(node.d, seed_shape + np.shape(node.v)).reshape(seed_shape + (size,))
+            rows.append(np.moveaxis(d, -1, 0))
+        return np.concatenate(rows)
+
+    def _record(self, *args):
+        '''Runs the forward pass without derivatives, recording it on a Tape'''
+
+        # No derivatives: seed 0 for every input
+        with self._seeded([0 for _ in range(count_recursive(args))]):
+            with Tape() as tape:
+                out = self._forward(*args)
+                tape.record_inputs(self._flat_inputs())
+                tape.record_outputs(out)
+
+        tape = tape.finalize()
+        if self.optimize:
+            tape, self.optimization = optimize_tape(tape)
+        self.tape = tape
+        return self.tape
+
+    def _flat_inputs(self):
+        '''Input Node objects, unpacked in case they are contained in an array or similar'''
         new_input = []
         for var in self.input_nodes:
             if hasattr(type(var), '__len__'):
                 new_input += [x for x in var]
             else:
                 new_input.append(var)
+        return new_input
+
+    def _reverse(self, *args, retain_graph=True):
+        '''Reverse mode Jacobian. With retain_graph=False the graph is freed as soon as
+        possible: the Nodes once recorded, the back-gradients during the sweep and the tape
+        after it, leaving self.input_nodes, self.output_nodes and self.tape set to None.'''
+
+        tape = self._record(*args)
+        if not retain_graph:
+            self.input_nodes = self.output_nodes = self.tape = None
+            return self._sweep(tape, retain=False)[0]
+
+        jacobian, adj = self._sweep(tape)
+        for n, i in zip(self._flat_inputs(), tape.inputs):
+            n.back_g = adj[i]
+        return jacobian
+
+    def _sweep(self, tape, back_seed=None, retain=True):
+        '''Reverse sweep over a recorded tape. Returns the Jacobian and the back-gradients.
+
+        back_seed: (w, m) array, one row of back-gradients of the outputs per sweep direction.
+        Defaults to the identity, giving the full Jacobian; otherwise back_seed @ Jacobian
+        is returned.
+        retain: passed to Tape.reverse, False frees back-gradients during the sweep.
+        '''
+        values = tape.values
+        self.n = sum(np.size(values[i]) for i in tape.inputs)
+        self.m = sum(np.size(values[i]) for i in tape.outputs)
 
-        for n in new_input:
-            # If input node does not influence the output, its gradient has to be
-            #  manually set to have the correct size
+        # Set df/dx_n of the output to 1
+        self.back_seed = np.eye(self.m) if back_seed is None else back_seed
+        w = len(self.back_seed)
+        seeds = []
+        k = 0
+        for i in tape.outputs:
+            size = np.size(values[i])
+            seeds.append(self.back_seed[:, k:k + size].reshape((w,) + np.shape(values[i])))
+            k += size
+
+        # Single loop over the tape, from the last slot to the first
+        adj = tape.reverse(seeds, retain=retain)
+
+        if isinstance(adj, np.ndarray):
+            # One row of adj per input
+            return adj[tape.inputs].T, adj
+
+        # One column per input element. If an input node does not influence the output,
+        #  its gradient has to be manually set to have the correct size
+        columns = [np.broadcast_to(adj[i], (w,) + np.shape(values[i])).reshape(w, -1)
+                   for i in tape.inputs]
+        jacobian = np.concatenate(columns, axis=1) if columns else np.zeros((w, 0))
+        return jacobian, adj
+
+    def _replay(self, *args):
+        '''Gradient from the recorded tape re-evaluated at args, recording f again if the
+        inputs have a different structure or a recorded comparison changes outcome'''
+        key = input_structure(args, self.vectorize)
+        tape = self._replay_tape
+        if tape is None or self._tape_key != key or \
+                not tape.replay(flat_args(args, self.vectorize)):
+            tape = self._replay_tape = self._record(*args)
+            self._tape_key = key
+        return self._sweep(tape)[0]
+
+    def _incremental_grad(self, *args):
+        '''Gradient from the kept tape, updated for the inputs that changed since the last
+        call, recording f again if the inputs have a different structure or a recorded
+        comparison changes outcome'''
+        if self.vectorize:
+            raise ValueError('Incremental evaluation is not supported with vectorize=True')
+        key = input_structure(args, self.vectorize)
+        state = self._incremental
+        if state is None or self._incremental_key != key or \
+                not state.update(flat_args(args, self.vectorize)):
+            state = self._incremental = IncrementalTape(self._record(*args))
+            self._incremental_key = key
+        jacobian = state.jacobian()
+        self.m, self.n = jacobian.shape
+        return jacobian
+
+    def _compiled_grad(self, *args):
+        '''Gradient from the compiled tape for the structure of args, recording and
+        compiling f first if there is none yet or a recorded comparison changes outcome'''
+        key = input_structure(args, self.vectorize)
+        compiled = self._compiled.get(key)
+        if compiled is not None:
             try:
-                if n.back_g == 0:
-                    n.back_g = np.zeros(len(self.output_nodes))
-            except:
+                outputs, jacobian = compiled(flat_args(args, self.vectorize))
+                self.m, self.n = jacobian.shape
+                return jacobian
+            except Retrace:
                 pass
-
-        # Return the transpose for (obvious?) mathematical reasons
-        return np.array([x.back_g for x in new_input]).T
+        tape = self._record(*args)
+        if compiled is not None or key not in self._compiled:
+            compiled = compile_tape(tape)
+            with self._lock:
+                self._compiled[key] = compiled
+        return self._sweep(tape)[0]
+
+def _jacobian_block(f, args, validate, vectorize, chunk_size, mode, start, stop):
+    '''Columns (forward mode) or rows (reverse mode) start to stop of the Jacobian of f.
+    Runs in the worker processes of AD(f, processes=...)'''
+    adobj = AD(f, validate=validate, vectorize=vectorize, chunk_size=chunk_size)
+    if mode == 'forward':
+        return adobj._forward_columns(args, count_recursive(args), start, stop)
+    tape = adobj._record(*args)
+    m = sum(np.size(tape.values[i]) for i in tape.outputs)
+    return adobj._sweep(tape, np.eye(m)[start:stop])[0]
+
+def _operand(a):
+    # np.arrays (and lists) of Nodes become one array valued Node
+    if isinstance(a, (list, tuple)):
+        a = np.array(a)
+    if isinstance(a, np.ndarray) and a.dtype == object:
+        return stack(a)
+    return a
+
+def _vectorized(args):
+    # numpy calls run as one BaseFunction when no np.arrays (or lists) are among the
+    # arguments, or when a Node holds an array (as with vectorize=True). np.arrays of scalar
+    # Nodes otherwise keep numpy's elementwise loop, giving one scalar Node per element
+    if any(isinstance(a, Node) and np.ndim(a.v) for a in args):
+        return True
+    return not any(isinstance(a, (np.ndarray, list, tuple)) for a in args)
+
+def _array_sum(a, axis=None, **kwargs):
+    if axis is not None or kwargs or not _vectorized((a,)):
+        return NotImplemented
+    return _sum(_operand(a))
+
+def _array_prod(a, axis=None, **kwargs):
+    if axis is not None or kwargs or not _vectorized((a,)):
+        return NotImplemented
+    return _prod(_operand(a))
+
+def _array_mean(a, axis=None, **kwargs):
+    if axis is not None or kwargs or not _vectorized((a,)):
+        return NotImplemented
+    a = _operand(a)
+    return _sum(a) / np.size(a.v if isinstance(a, Node) else a)
+
+def _array_matmul(a, b, **kwargs):
+    if kwargs or not _vectorized((a, b)):
+        return NotImplemented
+    a, b = _operand(a), _operand(b)
+    if np.ndim(a.v if isinstance(a, Node) else a) not in (1, 2) or \
+            np.ndim(b.v if isinstance(b, Node) else b) not in (1, 2):
+        return NotImplemented
+    return _matmul(a, b)
+
+# BaseFunctions computing numpy ufuncs
+_UFUNCS = {
+    np.add: addition, np.subtract: subtraction, np.multiply: multiplication,
+    np.true_divide: division, np.floor_divide: floordiv, np.power: power,
+    np.positive: pos, np.negative: neg, np.absolute: _abs,
+    np.floor: floor, np.ceil: ceil, np.trunc: trunc,
+    np.exp: exp, np.exp2: lambda x: exp(x, 2), np.log: log,
+    np.log2: lambda x: log(x, 2), np.log10: lambda x: log(x, 10),
+    np.sqrt: sqrt, np.square: lambda x: power(x, 2), np.reciprocal: lambda x: division(1, x),
+    np.sin: sin, np.cos: cos, np.tan: tan, np.arcsin: arcsin, np.arccos: arccos,
+    np.arctan: arctan, np.sinh: sinh, np.cosh: cosh, np.tanh: tanh,
+    np.matmul: _array_matmul,
+}
+
+# Functions for numpy functions on Nodes. They return NotImplemented for the arguments
+# they do not handle, e.g. sums along an axis
+_ARRAY_FUNCTIONS = {
+    np.sum: _array_sum, np.prod: _array_prod, np.mean: _array_mean,
+    np.dot: _array_matmul, np.matmul: _array_matmul,
+}
 
 class Node():
     '''Represents a Node in the evaluation graph. Holds its value and derivative. 
@@ -170,22 +785,39 @@ class Node():
 
     Node(4, [1, 0, 0]):
         creates a node object with value 4 and derivative [1, 0, 0]
+    Node(4, [1, 0, 0], check=False):
+        same, but skips verifying that value and derivative are numeric. Used for Nodes
+        computed from already verified Nodes, e.g. the outputs of BaseFunctions.
+
+    Nodes use __slots__ rather than a per-instance __dict__, since graphs can hold
+        millions of them.
+
+    numpy ufuncs and np.sum, np.prod, np.mean, np.dot and np.matmul called on Nodes (e.g.
+        np.sin(x), np.dot(w, x)) use the BaseFunctions, as the operators do. When a Node
+        holds an array (vectorize=True), np.arrays of Nodes among their arguments are first
+        made a single array valued Node (see stack), so each call is one vectorized
+        primitive rather than one per element. Otherwise np.arrays of scalar Nodes are
+        handled elementwise by numpy, giving np.arrays of scalar Nodes as before.
     '''
 
-    def __init__(self, v, d=0):
+    __slots__ = ('v', 'd', 'parents', 'f', 'back_g', 'i')
+
+    def __init__(self, v, d=0, check=True):
         self.v = v
         self.d = d # if derivative is none its assumed to be 0 (for constant node)
 
         # Verify that numeric
-        try:
-            np.asarray(self.v, dtype=np.float64)
-            np.asarray(self.d, dtype=np.float64)
-        except:
-            raise TypeError('Value and derivative must be numeric.')
+        if check:
+            try:
+                np.asarray(v, dtype=np.float64)
+                np.asarray(d, dtype=np.float64)
+            except:
+                raise TypeError('Value and derivative must be numeric.')
 
         self.parents = None
         self.f = None
         self.back_g = 0 #Backprop gradient
+        self.i = None # slot on the Tape recording it, if any
 
 
     def __add__(self, other):
@@ -220,6 +852,64 @@ class Node():
         return _abs(self)
     def __invert__(self):
         return invert(self)
+    def __getitem__(self, key):
+        return index(self, key)
+    def sum(self):
+        return _sum(self)
+    @property
+    def shape(self):
+        return np.shape(self.v)
+
+    # numpy functions call these on Nodes, e.g. np.sin(x) when the value x of a Node is
+    # itself a Node (as in second order derivatives)
+    def exp(self):
+        return exp(self)
+    def log(self):
+        return log(self)
+    def sqrt(self):
+        return sqrt(self)
+    def sin(self):
+        return sin(self)
+    def cos(self):
+        return cos(self)
+    def tan(self):
+        return tan(self)
+    def arcsin(self):
+        return arcsin(self)
+    def arccos(self):
+        return arccos(self)
+    def arctan(self):
+        return arctan(self)
+    def sinh(self):
+        return sinh(self)
+    def cosh(self):
+        return cosh(self)
+    def tanh(self):
+        return tanh(self)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        function = _UFUNCS.get(ufunc)
+        if function is not None and method == '__call__' and not kwargs and _vectorized(inputs):
+            result = function(*[_operand(a) for a in inputs])
+            if result is not NotImplemented:
+                return result
+        # Other ufuncs (e.g. comparisons) run numpy's loop over Python objects, which calls
+        # the operators of Node
+        inputs = [np.array(a, dtype=object) if isinstance(a, Node) else a for a in inputs]
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if isinstance(result, np.ndarray) and result.ndim == 0:
+            return result[()]
+        return result
+
+    def __array_function__(self, func, types, args, kwargs):
+        function = _ARRAY_FUNCTIONS.get(func)
+        if function is not None:
+            result = function(*args, **kwargs)
+            if result is not NotImplemented:
+                return result
+        # e.g. np.shape(x): numpy's own implementation, which uses the attributes of Node
+        return func._implementation(*args, **kwargs)
+
     def __round__(self, n):
         if isinstance(n, Node):
             return _round(self, n.v)
@@ -236,22 +926,27 @@ class Node():
     def __ne__(self, other):
         return self.v.__ne__(other.v) or self.d.__ne__(other.d)
 
-    def __lt__(self, other):
-        if self.v.__eq__(other.v):
+    def _compare(self, other, op):
+        if not isinstance(other, Node):
+            other = Node(other)
+        # Compare plain values, also when Nodes are nested
+        if value(self) == value(other):
             raise ValueError("Comparison not differentiable")
-        return self.v.__lt__(other.v)
+        result = op(value(self), value(other))
+        # The outcome decides a branch of the function: record it so replays can check it
+        tape = current_tape()
+        if tape is not None:
+            tape.guard(op, self, other, result)
+        return result
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
     def __gt__(self, other):
-        if self.v.__eq__(other.v):
-            raise ValueError("Comparison not differentiable")
-        return self.v.__gt__(other.v)
+        return self._compare(other, operator.gt)
     def __le__(self, other):
-        if self.v.__eq__(other.v):
-            raise ValueError("Comparison not differentiable")
-        return self.v.__le__(other.v)
+        return self._compare(other, operator.le)
     def __ge__(self, other):
-        if self.v.__eq__(other.v):
-            raise ValueError("Comparison not differentiable")
-        return self.v.__ge__(other.v)
+        return self._compare(other, operator.ge)
     def __complex__(self):
         raise NotImplementedError("Complex numbers are not supported")
         
@@ -263,6 +958,18 @@ class Node():
         return "Node(" + str(self.v) + ", " + str(self.d) + ")"
 
 
+class View(Node):
+    '''Argument Node reused by the sweeps over a Tape: holds the value of a slot, and
+    whether that slot is a constant, which adjoint rules can use to skip terms whose
+    back-gradient is thrown away'''
+
+    __slots__ = ('constant',)
+
+    def __init__(self):
+        super().__init__(0.0, check=False)
+        self.constant = False
+
+
 def grad(f):
     '''Syntactic sugar for AD(f).grad.
 
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+class LRUCache():
+    '''Bounded mapping that evicts the least recently used entry when it is full.
+
+    cache = LRUCache(128)
+    -   cache.get(key) returns the value stored for key, or None (a miss).
+    -   cache.put(key, value) stores value, evicting the least recently used entry if the
+        cache already holds maxsize entries.
+    -   cache.info() returns the hits, misses and evictions so far, with the maximum and
+        current number of entries, as functools.lru_cache does.
+
+    Can be shared between threads.
+    '''
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError('The size of a cache must be a positive integer')
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._entries))
+
+    def clear(self):
+        '''Drops every entry and resets the statistics'''
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+def array_key(*values):
+    '''Hashable key of numeric values (numbers, lists or np.arrays): the type, dtype, shape
+    and a digest of the bytes of each. Returns None if a value is not numeric, e.g. holds
+    Nodes, in which case it cannot be used as a key.'''
+    key = []
+    for a in values:
+        if a is None:
+            key.append(None)
+            continue
+        try:
+            array = np.asarray(a)
+        except ValueError:
+            # Nested sequences of different lengths
+            return None
+        if array.dtype == object:
+            return None
+        digest = hashlib.blake2b(np.ascontiguousarray(array).tobytes(), digest_size=16).digest()
+        key.append((type(a).__name__, array.dtype.str, array.shape, digest))
+    return tuple(key)
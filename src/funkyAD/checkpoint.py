@@ -0,0 +1,121 @@
+import numpy as np
+from .functions import BaseFunction
+from .tape import Tape, current_tape, paused
+
+def _flatten(values):
+    '''Flattens Nodes and numbers, or lists / np.arrays of them, into a list of leaves.
+    Returns the leaves and a function rebuilding the same structure from new leaves.'''
+    leaves, sizes = [], []
+    for v in values:
+        if isinstance(v, (list, np.ndarray)):
+            leaves.extend(v)
+            sizes.append((type(v), len(v)))
+        else:
+            leaves.append(v)
+            sizes.append(None)
+
+    def rebuild(new):
+        out, k = [], 0
+        for size in sizes:
+            if size is None:
+                out.append(new[k])
+                k += 1
+            else:
+                kind, length = size
+                part = list(new[k:k + length])
+                out.append(np.array(part) if kind is np.ndarray else part)
+                k += length
+        return out
+    return leaves, rebuild
+
+class _Segment():
+    '''One call of a checkpointed function. Its outputs are recorded as single operations
+    of the inputs; the operations inside are recomputed when their derivatives are needed.
+    '''
+
+    def __init__(self, fn, rebuild):
+        self.fn = fn
+        self.rebuild = rebuild
+        # Tape of the recomputation, kept while the sweep needs it
+        self.tape = None
+        self.pending = 0
+        self._last = None
+
+    def run(self, args):
+        '''Evaluates fn without recording, on copies of the argument Nodes. Returns the
+        list of output Nodes.'''
+        from .base import Node
+        with paused():
+            out = self.fn(*self.rebuild([Node(a.v, a.d, check=False) for a in args]))
+        leaves, _ = _flatten([out])
+        return [a if isinstance(a, Node) else Node(a) for a in leaves]
+
+    def value(self, k, args):
+        '''Value of output k (recomputed once for all outputs at the same inputs)'''
+        values = [a.v for a in args]
+        if self._last is None or any(not np.array_equal(a, b) for a, b in zip(values, self._last[0])):
+            self._last = (values, [n.v for n in self.run(args)])
+        return self._last[1][k]
+
+    def vjp(self, k, g, args):
+        '''Contributions of the back-gradient g of output k to the inputs. Records fn again
+        the first time, and drops that recording once every output has been swept.'''
+        from .base import Node
+        if self.tape is None:
+            inputs = [Node(a.v, 0, check=False) for a in args]
+            with Tape() as tape:
+                out = self.fn(*self.rebuild(inputs))
+                leaves, _ = _flatten([out])
+                tape.record_inputs(inputs)
+                tape.record_outputs([a if isinstance(a, Node) else Node(a) for a in leaves])
+            self.tape = tape.finalize()
+            self.pending = len(leaves)
+        tape = self.tape
+        seeds = [g if j == k else 0 for j in range(len(tape.outputs))]
+        adj = tape.reverse(seeds, retain=False)
+        # (Outputs that receive no back-gradient are never swept: the recording is then
+        # only dropped with the outer tape)
+        self.pending -= 1
+        if self.pending == 0:
+            self.tape = None
+        return [adj[i] for i in tape.inputs]
+
+def checkpoint(fn):
+    '''Wraps fn (a function of Nodes, numbers, or lists / np.arrays of them, returning one
+    of these) so that reverse mode does not keep the operations inside fn.
+
+    When a Tape is recording, each call of the wrapped function runs fn without recording
+    and records each of its outputs as a single operation of the inputs. During the
+    reverse sweep, fn is recorded again at the saved inputs, that recording is swept, and
+    it is dropped. Outside of reverse mode the wrapped function simply calls fn.
+
+    Wrapping the steps of a long computation in segments of about sqrt(T) steps keeps
+    only the segment boundaries, i.e. O(sqrt(T)) memory, for one extra evaluation of f.
+    '''
+    def wrapped(*args):
+        tape = current_tape()
+        if tape is None:
+            return fn(*args)
+        from .base import Node
+        leaves, rebuild = _flatten(args)
+        leaves = [a if isinstance(a, Node) else Node(a) for a in leaves]
+
+        # Evaluated without recording: only the outputs are recorded below
+        with paused():
+            out = fn(*rebuild(leaves))
+        out_leaves, out_rebuild = _flatten([out])
+        segment = _Segment(fn, rebuild)
+
+        results = []
+        for k, a in enumerate(out_leaves):
+            v, d = (a.v, a.d) if isinstance(a, Node) else (a, 0)
+            # Fresh Node, so that the Nodes created inside fn can be freed
+            node = Node(v, d, check=False)
+            node.f = BaseFunction(lambda *x, k=k: segment.value(k, x),
+                                  lambda *x, k=k: segment.run(x)[k].d,
+                                  lambda g, *x, k=k: segment.vjp(k, g, x))
+            node.parents = leaves
+            tape.record(node)
+            results.append(node)
+        return out_rebuild(results)[0]
+    return wrapped
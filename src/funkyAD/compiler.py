@@ -0,0 +1,104 @@
+import operator
+import numpy as np
+from .tape import INPUT, CONST
+
+# Source code of the comparisons that can be recorded as guards on a tape
+_COMPARISONS = {operator.lt: '<', operator.gt: '>', operator.le: '<=', operator.ge: '>='}
+
+class Retrace(Exception):
+    '''Raised by a compiled tape when a recorded comparison changes outcome: the function
+    takes another branch at these inputs and has to be recorded again.'''
+    pass
+
+def compile_tape(tape):
+    '''Generates a Python function computing the outputs and the full Jacobian of a
+    recorded (finalized) Tape as straight-line numpy statements.
+
+    compiled = compile_tape(tape)
+    outputs, jacobian = compiled(inputs)
+    -   inputs: one value per input slot of the tape, in order.
+    -   outputs: array of the m output values, jacobian: (m, n) array.
+    -   raises Retrace if a comparison recorded on the tape has a different outcome.
+    -   compiled.source holds the generated code.
+
+    Returns None if the tape cannot be compiled: array valued slots, or BaseFunctions
+    without a template (see BaseFunction) such as abs or floor, whose checks would be
+    skipped by compiled code.
+    '''
+    if not tape.scalar:
+        return None
+    op, ptr, idx = tape.op.tolist(), tape.ptr.tolist(), tape.idx.tolist()
+    templates = [f.template for f in tape.functions]
+    m, n = len(tape.outputs), len(tape.inputs)
+
+    lines = ['def compiled(inputs):',
+             '    x = np.asarray(inputs, dtype=np.float64)']
+    for k, i in enumerate(tape.inputs):
+        lines.append('    v%d = x[%d]' % (i, k))
+
+    # Forward pass: one statement per slot
+    guards = iter(tape.guards)
+    guard = next(guards, None)
+    for i in range(len(op) + 1):
+        while guard is not None and guard[0] == i:
+            _, compare, a, b, result = guard
+            if compare not in _COMPARISONS:
+                return None
+            test = 'v%d %s v%d' % (a, _COMPARISONS[compare], b)
+            lines.append('    if v%d == v%d or %s(%s): raise Retrace'
+                         % (a, b, 'not ' if result else '', test))
+            guard = next(guards, None)
+        if i == len(op):
+            break
+        if op[i] == CONST:
+            lines.append('    v%d = c[%d]' % (i, i))
+        elif op[i] != INPUT:
+            template = templates[op[i]]
+            parents = idx[ptr[i]:ptr[i + 1]]
+            if template is None or len(template) != len(parents) + 1:
+                return None
+            for j, partial in zip(parents, template[1:]):
+                if partial is None and op[j] != CONST:
+                    return None
+            names = ['v%d' % j for j in parents]
+            lines.append('    v%d = %s' % (i, template[0].format(*names, out='v%d' % i)))
+
+    # Reverse pass: back-gradients g<slot> of shape (m,), created by their first contribution
+    lines.append('    E = np.eye(%d)' % m)
+    defined = set()
+    def accumulate(j, expression):
+        if j in defined:
+            lines.append('    g%d = g%d + %s' % (j, j, expression))
+        else:
+            lines.append('    g%d = %s' % (j, expression))
+            defined.add(j)
+    for k, i in enumerate(tape.outputs):
+        accumulate(i, 'E[%d]' % k)
+    for i in range(len(op) - 1, -1, -1):
+        if op[i] < 0 or i not in defined:
+            continue
+        parents = idx[ptr[i]:ptr[i + 1]]
+        names = ['v%d' % j for j in parents]
+        for j, partial in zip(parents, templates[op[i]][1:]):
+            # Back-gradients of constants are never used
+            if op[j] == CONST:
+                continue
+            partial = partial.format(*names, out='v%d' % i)
+            if partial == '1':
+                accumulate(j, 'g%d' % i)
+            elif partial == '-1':
+                accumulate(j, '-g%d' % i)
+            else:
+                accumulate(j, '(%s) * g%d' % (partial, i))
+
+    outputs = ', '.join('v%d' % i for i in tape.outputs)
+    columns = ', '.join('g%d' % i if i in defined else 'np.zeros(%d)' % m for i in tape.inputs)
+    lines.append('    return np.array([%s]), np.array([%s]).reshape(%d, %d).T'
+                 % (outputs, columns, n, m))
+    source = '\n'.join(lines) + '\n'
+
+    namespace = {'np': np, 'Retrace': Retrace, 'c': tape.values.copy()}
+    exec(compile(source, '<funkyAD compiled tape>', 'exec'), namespace)
+    compiled = namespace['compiled']
+    compiled.source = source
+    return compiled
@@ -1,24 +1,45 @@
 import numpy as np
+from .helpers import align_derivatives
+from .tape import current_tape
 
 class BaseFunction():
     '''Defines a function that can be used on Node objects and propagate the partial derivatives
 
-    BaseFunction(function, derivative)
+    BaseFunction(function, derivative, adjoint=None, template=None, taylor=None)
 
     - function: function with n Node arguments and m Node outputs. Can use any operation between integers,
         including computations perfomed by secondary libraries (e.g. numpy).
     - derivative: function that (symbolically or numerically) evaluates the derivative of the
         given function. Takes Node objects as input/output. Again, can use secondary library functions.
+    - adjoint (optional): function used by reverse mode. Takes the back-gradient g of the output
+        followed by the Node arguments, and returns a tuple with the contribution g * df/darg to
+        the back-gradient of each argument, in order. If not given, reverse mode falls back to
+        evaluating derivative once per argument.
+    - template (optional): numpy source code of the value and of the partial derivative with
+        respect to each argument, as format strings where {0}, {1}, ... are the argument values
+        and {out} the value. E.g. ('{0} * {1}', '{1}', '{0}') for multiplication. Needed to
+        compile recorded tapes to straight-line code (see compiler.py). A partial of None
+        means the tape can only be compiled when that argument is a constant.
+    - taylor (optional): Taylor coefficient rule, used by AD.taylor. Takes the truncated Taylor
+        series of each argument (arrays of coefficients, lowest order first) and returns the
+        series of the output, to the same order.
 
     BaseFunction(f, d)(Node(5, 4), Node(2, 6)):
         equals: Node(f(Node(5, 4), Node(2, 6)), d(Node(5, 4), Node(2, 6)))
 
     Returns a Node object by applying the specified function and the specified derivative.
+
+    Values can also be np.arrays (see AD(f, vectorize=True)). The derivative of such a Node has
+    shape seed_width + value.shape, and its back-gradient (m,) + value.shape, so elementwise
+    functions written with numpy work unchanged: e.g. x.d * np.cos(x.v) broadcasts.
     '''
 
-    def __init__(self, function, derivative):
+    def __init__(self, function, derivative, adjoint=None, template=None, taylor=None):
         self.f = function
         self.d = derivative
+        self.adjoint = adjoint
+        self.template = template
+        self.taylor = taylor
 
     def __call__(self, *args):
         # Deferred import to work around circular dependencies
@@ -26,76 +47,128 @@ class BaseFunction():
         # Replace constants with node objects with no derivative
         new_args = [a if isinstance(a, Node) else Node(a) for a in args]
 
-        new = Node(self.f(*new_args), self.d(*new_args))
+        # Computed from verified Nodes, so no need to check again
+        new = Node(self.f(*new_args), self.d(*align_derivatives(new_args)), check=False)
         new.f = self
         new.parents = new_args
 
+        # Record the operation if a Tape is recording (reverse mode)
+        tape = current_tape()
+        if tape is not None:
+            tape.record(new)
+
         return new
 
-addition = BaseFunction(lambda x, y: x.v + y.v, lambda x, y: x.d + y.d)
-subtraction = BaseFunction(lambda x, y: x.v - y.v, lambda x, y: x.d - y.d)
+    def vjp(self, g, *args):
+        '''Returns the contribution of back-gradient g to the back-gradient of each argument.
+
+        Uses the adjoint rule if there is one. Otherwise evaluates the derivative once per
+        argument on copies of the arguments, seeded with 1 for that argument only, so the
+        arguments themselves are never modified.
+        '''
+        if self.adjoint is not None:
+            return self.adjoint(g, *args)
+        from .base import Node
+        contributions = []
+        for i in range(len(args)):
+            seeded = [Node(a.v, 1.0 if j == i else 0.0, check=False) for j, a in enumerate(args)]
+            contributions.append(g * self.d(*seeded))
+        return contributions
+
+addition = BaseFunction(lambda x, y: x.v + y.v, lambda x, y: x.d + y.d, lambda g, x, y: (g, g))
+subtraction = BaseFunction(lambda x, y: x.v - y.v, lambda x, y: x.d - y.d, lambda g, x, y: (g, -g))
 
 # Product rule
-multiplication = BaseFunction(lambda x, y: x.v * y.v, lambda x, y: x.d * y.v + x.v * y.d)
+multiplication = BaseFunction(lambda x, y: x.v * y.v, lambda x, y: x.d * y.v + x.v * y.d,
+                              lambda g, x, y: (g * y.v, g * x.v))
 
 # Quotient rule
-division = BaseFunction(lambda x, y: x.v / y.v, lambda x, y: (y.v * x.d - x.v * y.d) / (y.v ** 2))
+division = BaseFunction(lambda x, y: x.v / y.v, lambda x, y: (y.v * x.d - x.v * y.d) / (y.v ** 2),
+                        lambda g, x, y: (g / y.v, -g * x.v / (y.v ** 2)))
+
+def power_derivative(x, y):
+    # y * x**(y - 1) rather than x**y * y / x, which divides by 0 at x = 0
+    base = x.d * y.v * x.v ** (y.v - 1)
+    # Skip the log(x) term when the exponent carries no derivative (always the case for
+    # constant exponents, and for every Node during the reverse mode forward pass)
+    if np.all(np.asarray(y.d) == 0):
+        return base
+    return base + y.d * (x.v ** y.v) * np.log(x.v)
+
+# Plain value of x, unwrapping Nodes whose value is a Node (as in second order derivatives).
+# Domain and differentiability checks look at this value
+def value(x):
+    from .base import Node
+    while isinstance(x, Node):
+        x = x.v
+    return x
+
+# Back-gradient of the exponent, g * x**y * log(x)
+def power_exponent_adjoint(g, x, y):
+    # log(x) is nan for x <= 0. When the exponent is a constant slot of a Tape (e.g. the 2
+    # in x**2, see View) that nan would only land in a back-gradient that is thrown away,
+    # so skip computing it
+    if getattr(y, 'constant', False) and np.any(np.asarray(value(x)) <= 0):
+        return 0
+    return g * (x.v ** y.v) * np.log(x.v)
 
 # Generalized Power Rule
 power = BaseFunction(lambda x, y: x.v ** y.v,
-                     lambda x, y: (x.v ** y.v) * (x.d * y.v / x.v + y.d * np.log(x.v)) )
+                     power_derivative,
+                     lambda g, x, y: (g * y.v * x.v ** (y.v - 1), power_exponent_adjoint(g, x, y)))
 
-sqrt = BaseFunction(lambda x: x.v**0.5, lambda x: x.d / (2*x.v**0.5))
+sqrt = BaseFunction(lambda x: x.v**0.5, lambda x: x.d / (2*x.v**0.5), lambda g, x: (g / (2*x.v**0.5),))
 
-pos = BaseFunction(lambda x: +x.v, lambda x: +x.d)
+pos = BaseFunction(lambda x: +x.v, lambda x: +x.d, lambda g, x: (+g,))
 # Negation (or taking the negative of, i.e. changing sign)
-neg = BaseFunction(lambda x: -x.v, lambda x: -x.d)
+neg = BaseFunction(lambda x: -x.v, lambda x: -x.d, lambda g, x: (-g,))
 
 # Function to raise error if function is non-differentiable
 def invalid_op(name):
     raise ValueError("Function '" + name + "' is not differentiable")
 
-# Get sign of a value
+# Get sign of a value (elementwise for arrays)
 def sign(x):
-    if x < 0:
-        return -1
-    elif x > 0:
-        return 1
-    else:
+    x = value(x)
+    if np.any(np.asarray(x) == 0):
         invalid_op('abs')
+    return np.sign(x)
 
-_abs = BaseFunction(lambda x: abs(x.v), lambda x: x.d * sign(x.v))
-invert = BaseFunction(lambda x: x.v.__invert__(), lambda x: invalid_op("__invert__"))
+_abs = BaseFunction(lambda x: abs(x.v), lambda x: x.d * sign(x.v), lambda g, x: (g * sign(x.v),))
+invert = BaseFunction(lambda x: x.v.__invert__(), lambda x: invalid_op("__invert__"),
+                      lambda g, x: invalid_op("__invert__"))
 
 # The derivative of the floor of x is 0 when x is non-integer and not defined when it is
 def r_der(x):
     # Derivative of rounding functions
-    if np.ceil(x) == x and np.floor(x) == x:
+    x = value(x)
+    if np.any(np.floor(x) == x):
         # Derivative of floor of integer is not mathematically defined
         invalid_op('rounding')
-    return 0
+    return 0 * np.asarray(x, dtype=np.float64)
 
 # Rounding the value of a node with specified digits
 def round1(x, n=0):
-    from .base import Node
-    if isinstance(n, Node):
-        n = n.v
+    n = value(n)
     return np.round(x.v * (10 ** n)) / (10. ** n)
 
 # Roundin the derivative of a node with specified digits
 def round2(x, n=0):
-    from .base import Node
-    if isinstance(n, Node):
-        n = n.v
+    n = value(n)
     return r_der(x.v * (10 ** n))
 
+# Back-gradient of rounding (the number of digits is not differentiated)
+def round3(g, x, *n):
+    return (g * round2(x, *n),) + (0,) * len(n)
+
 # Rounding
-_round = BaseFunction(round1, round2)
-floor = BaseFunction(lambda x: np.floor(x.v), lambda x: r_der(x.v))
-ceil = BaseFunction(lambda x: np.ceil(x.v), lambda x: r_der(x.v))
-trunc = BaseFunction(lambda x: np.trunc(x.v), lambda x: r_der(x.v))
+_round = BaseFunction(round1, round2, round3)
+floor = BaseFunction(lambda x: np.floor(x.v), lambda x: r_der(x.v), lambda g, x: (g * r_der(x.v),))
+ceil = BaseFunction(lambda x: np.ceil(x.v), lambda x: r_der(x.v), lambda g, x: (g * r_der(x.v),))
+trunc = BaseFunction(lambda x: np.trunc(x.v), lambda x: r_der(x.v), lambda g, x: (g * r_der(x.v),))
 
-floordiv = BaseFunction(lambda x, y: x.v // y.v, lambda x, y: r_der(x.v / y.v))
+floordiv = BaseFunction(lambda x, y: x.v // y.v, lambda x, y: r_der(x.v / y.v),
+                        lambda g, x, y: (g * r_der(x.v / y.v), g * r_der(x.v / y.v)))
 
 # np.e**2 != np.exp(2), the former is slightly more precise
 # math.e**2 != np.exp(2), same
@@ -106,9 +179,7 @@ floordiv = BaseFunction(lambda x, y: x.v // y.v, lambda x, y: r_der(x.v / y.v))
 # Decorator to verify valid base of exponentiation or logarithm
 def base_check(f):
     def inner(x, b = np.e):
-        from .base import Node
-        if isinstance(b, Node):
-            b = b.v
+        b = value(b)
         if b <= 0:
             raise ValueError('Base must be positive')
         return f(x, b)
@@ -132,7 +203,20 @@ def exp2(x, b = np.e):
     else:
         return x.d * np.log(b) * b ** x.v
 
-exp = BaseFunction(exp1, exp2)
+# Partial derivative of exponentials
+@base_check
+def exp3(x, b = np.e):
+    from .base import Node
+    if b == np.e:
+        return np.exp(x.v)
+    elif isinstance(x.v, Node):
+        # Second order derivatives: Nodes cannot be exponents (b ** node), use the function
+        return np.log(b) * exp(x.v, b)
+    else:
+        return np.log(b) * b ** x.v
+
+# The base is treated as a constant, as in exp2
+exp = BaseFunction(exp1, exp2, lambda g, x, *b: (g * exp3(x, *b),) + (0,) * len(b))
 
 @base_check
 def log1(x, b = np.e):
@@ -143,37 +227,46 @@ def log1(x, b = np.e):
 def log2(x, b = np.e):
     return x.d / (x.v * np.log(b))
 
-log = BaseFunction(log1, log2)
+@base_check
+def log3(x, b = np.e):
+    return 1 / (x.v * np.log(b))
+
+log = BaseFunction(log1, log2, lambda g, x, *b: (g * log3(x, *b),) + (0,) * len(b))
 
 # Trigonometric functions
-sin = BaseFunction(lambda x: np.sin(x.v), lambda x: x.d * np.cos(x.v))
-cos = BaseFunction(lambda x: np.cos(x.v), lambda x: -x.d * np.sin(x.v))
-tan = BaseFunction(lambda x: np.tan(x.v), lambda x: x.d / (np.cos(x.v) ** 2))
+sin = BaseFunction(lambda x: np.sin(x.v), lambda x: x.d * np.cos(x.v), lambda g, x: (g * np.cos(x.v),))
+cos = BaseFunction(lambda x: np.cos(x.v), lambda x: -x.d * np.sin(x.v), lambda g, x: (-g * np.sin(x.v),))
+tan = BaseFunction(lambda x: np.tan(x.v), lambda x: x.d / (np.cos(x.v) ** 2),
+                   lambda g, x: (g / (np.cos(x.v) ** 2),))
 
 # Complex numbers are not supported: verify inv angle in valid range
 def one_check(f):
     def inner(x):
-        from .base import Node
-        if isinstance(x, Node):
-            val = x.v
-        else:
-            val = x
-        if not np.abs(val) < 1:
+        val = value(x)
+        if not np.all(np.abs(val) < 1):
             raise ValueError('Angle must be between -1 and 1 exclusive')
         return f(x)
     return inner
 
+# Partial derivatives of the inverse trigonometric functions
+arcsin_partial = one_check(lambda x: 1 / np.sqrt(1 - x.v**2))
+arccos_partial = one_check(lambda x: -1 / np.sqrt(1 - x.v**2))
+arctan_partial = one_check(lambda x: 1 / (1 + x.v**2))
+
 arcsin = BaseFunction(
     one_check(lambda x: np.arcsin(x.v)), 
-    one_check(lambda x: x.d/np.sqrt(1 - x.v**2))
+    one_check(lambda x: x.d/np.sqrt(1 - x.v**2)),
+    lambda g, x: (g * arcsin_partial(x),)
 )
 arccos = BaseFunction(
     one_check(lambda x: np.arccos(x.v)), 
-    one_check(lambda x: -x.d / np.sqrt(1 - x.v**2))
+    one_check(lambda x: -x.d / np.sqrt(1 - x.v**2)),
+    lambda g, x: (g * arccos_partial(x),)
 )
 arctan = BaseFunction(
     one_check(lambda x: np.arctan(x.v)), 
-    one_check(lambda x: x.d / (1 + x.v**2))
+    one_check(lambda x: x.d / (1 + x.v**2)),
+    lambda g, x: (g * arctan_partial(x),)
 )
 
 # Hyperbolic functions
@@ -184,17 +277,419 @@ arctan = BaseFunction(
 # Since most users presumably use np.sinh or similar, we implement using that
 # Otherwise their tests may fail
 
-sinh = BaseFunction(lambda x: np.sinh(x.v), lambda x: x.d*np.cosh(x.v))
-cosh = BaseFunction(lambda x: np.cosh(x.v), lambda x: x.d*np.sinh(x.v))
-tanh = BaseFunction(lambda x: np.tanh(x.v), lambda x: x.d/(np.cosh(x.v)**2))
+sinh = BaseFunction(lambda x: np.sinh(x.v), lambda x: x.d*np.cosh(x.v), lambda g, x: (g*np.cosh(x.v),))
+cosh = BaseFunction(lambda x: np.cosh(x.v), lambda x: x.d*np.sinh(x.v), lambda g, x: (g*np.sinh(x.v),))
+tanh = BaseFunction(lambda x: np.tanh(x.v), lambda x: x.d/(np.cosh(x.v)**2),
+                    lambda g, x: (g/(np.cosh(x.v)**2),))
 
 # General logistic function
 # Many ways of defining it, we do it using L(x) = upper_bound/(1+rate*exp(-x))
 logistic = BaseFunction(
     lambda x, u, r: u.v/(1+r.v*np.exp(-x.v)), 
-    lambda x, u, r: x.d*u.v*r.v*np.exp(x.v)/(r.v + np.exp(x.v))**2
+    lambda x, u, r: x.d*u.v*r.v*np.exp(x.v)/(r.v + np.exp(x.v))**2,
+    # Bound and rate are treated as constants, as in the derivative
+    lambda g, x, u, r: (g*u.v*r.v*np.exp(x.v)/(r.v + np.exp(x.v))**2, 0, 0)
 )
 
 # Sigmoid: specific case of logistic used for neural nets
 sigmoid = BaseFunction(
-    lambda x: 1/(1+np.exp(-x.v)), lambda x: x.d*np.exp(x.v)/(1+np.exp(x.v))**2)
+    lambda x: 1/(1+np.exp(-x.v)), lambda x: x.d*np.exp(x.v)/(1+np.exp(x.v))**2,
+    lambda g, x: (g*np.exp(x.v)/(1+np.exp(x.v))**2,))
+
+# Source code templates used to compile tapes (see compiler.py). Only given for functions
+# without domain or differentiability checks, which compiled code would not perform
+addition.template = ('{0} + {1}', '1', '1')
+subtraction.template = ('{0} - {1}', '1', '-1')
+multiplication.template = ('{0} * {1}', '{1}', '{0}')
+division.template = ('{0} / {1}', '1 / {1}', '-{0} / {1} ** 2')
+power.template = ('{0} ** {1}', '{1} * {0} ** ({1} - 1)', None)
+sqrt.template = ('{0} ** 0.5', '0.5 / {out}')
+pos.template = ('+{0}', '1')
+neg.template = ('-{0}', '-1')
+# Only with the natural base, i.e. with a single argument
+exp.template = ('np.exp({0})', '{out}')
+log.template = ('np.log({0})', '1 / {0}')
+sin.template = ('np.sin({0})', 'np.cos({0})')
+cos.template = ('np.cos({0})', '-np.sin({0})')
+tan.template = ('np.tan({0})', '1 / np.cos({0}) ** 2')
+sinh.template = ('np.sinh({0})', 'np.cosh({0})')
+cosh.template = ('np.cosh({0})', 'np.sinh({0})')
+tanh.template = ('np.tanh({0})', '1 / np.cosh({0}) ** 2')
+sigmoid.template = ('1 / (1 + np.exp(-{0}))', 'np.exp({0}) / (1 + np.exp({0})) ** 2')
+
+# Taylor coefficient rules (see AD.taylor). A series a holds the coefficients a[k] of t**k
+# of a function of t, i.e. its k-th derivative divided by k!. Each rule costs O(order**2)
+
+def series_constant(x, like):
+    c = np.zeros_like(like, dtype=np.float64)
+    c[0] = x
+    return c
+
+def series_mul(a, b):
+    return np.array([sum(a[j] * b[k - j] for j in range(k + 1)) for k in range(len(a))])
+
+def series_div(a, b):
+    c = []
+    for k in range(len(a)):
+        c.append((a[k] - sum(b[j] * c[k - j] for j in range(1, k + 1))) / b[0])
+    return np.array(c)
+
+# c = integral of a' * q, i.e. the series of a function with derivative q(a) * a'
+def series_integrate(a, q, c0):
+    c = [c0]
+    for k in range(1, len(a)):
+        c.append(sum(j * a[j] * q[k - j] for j in range(1, k + 1)) / k)
+    return np.array(c)
+
+def series_exp(a):
+    c = [np.exp(a[0])]
+    for k in range(1, len(a)):
+        c.append(sum(j * a[j] * c[k - j] for j in range(1, k + 1)) / k)
+    return np.array(c)
+
+def series_log(a):
+    c = [np.log(a[0])]
+    for k in range(1, len(a)):
+        c.append((a[k] - sum(j * c[j] * a[k - j] for j in range(1, k)) / k) / a[0])
+    return np.array(c)
+
+# a ** r for a constant exponent r
+def series_power(a, r):
+    if float(r).is_integer() and r >= 0:
+        # Repeated squaring, which also works when a[0] == 0
+        c, square, r = series_constant(1, a), a, int(r)
+        while r:
+            if r & 1:
+                c = series_mul(c, square)
+            square, r = series_mul(square, square), r >> 1
+        return c
+    c = [a[0] ** r]
+    for k in range(1, len(a)):
+        c.append(sum((r * j - (k - j)) * a[j] * c[k - j] for j in range(1, k + 1)) / (k * a[0]))
+    return np.array(c)
+
+# Sine and cosine (or hyperbolic sine and cosine, sign=1) are computed together
+def series_sincos(a, sign=-1):
+    s = [np.sinh(a[0]) if sign > 0 else np.sin(a[0])]
+    c = [np.cosh(a[0]) if sign > 0 else np.cos(a[0])]
+    for k in range(1, len(a)):
+        s.append(sum(j * a[j] * c[k - j] for j in range(1, k + 1)) / k)
+        c.append(sign * sum(j * a[j] * s[k - j] for j in range(1, k + 1)) / k)
+    return np.array(s), np.array(c)
+
+def series_power_rule(a, b):
+    # Constant exponent: no log(a), which is only defined for a > 0
+    if np.all(b[1:] == 0):
+        return series_power(a, b[0])
+    return series_exp(series_mul(b, series_log(a)))
+
+# Natural log of the (constant) base of exp and log
+def series_log_base(b):
+    if b[0] <= 0:
+        raise ValueError('Base must be positive')
+    return np.log(b[0])
+
+def series_exp_rule(a, *b):
+    if not b:
+        return series_exp(a)
+    return series_exp(a * series_log_base(b[0]))
+
+def series_log_rule(a, *b):
+    if not b:
+        return series_log(a)
+    return series_log(a) / series_log_base(b[0])
+
+def series_inverse_trig(a, f):
+    if not np.all(np.abs(a[0]) < 1):
+        raise ValueError('Angle must be between -1 and 1 exclusive')
+    # Derivative of arcsin: 1 / sqrt(1 - a**2). arccos is its opposite
+    q = series_power(series_constant(1, a) - series_mul(a, a), -0.5)
+    return series_integrate(a, q if f is np.arcsin else -q, f(a[0]))
+
+def series_arctan(a):
+    one = series_constant(1, a)
+    return series_integrate(a, series_div(one, one + series_mul(a, a)), np.arctan(a[0]))
+
+# Rounding functions are locally constant
+def series_rounding(f):
+    def rule(a):
+        r_der(a[0])
+        return series_constant(f(a[0]), a)
+    return rule
+
+def series_round(a, n=None):
+    digits = 0 if n is None else n[0]
+    r_der(a[0] * (10 ** digits))
+    return series_constant(np.round(a[0] * (10 ** digits)) / (10. ** digits), a)
+
+def series_floordiv(a, b):
+    r_der(a[0] / b[0])
+    return series_constant(a[0] // b[0], a)
+
+def series_logistic(a, u, r):
+    one = series_constant(1, a)
+    return series_div(u, one + series_mul(r, series_exp(-a)))
+
+addition.taylor = lambda a, b: a + b
+subtraction.taylor = lambda a, b: a - b
+multiplication.taylor = series_mul
+division.taylor = series_div
+power.taylor = series_power_rule
+sqrt.taylor = lambda a: series_power(a, 0.5)
+pos.taylor = lambda a: +a
+neg.taylor = lambda a: -a
+_abs.taylor = lambda a: sign(a[0]) * a
+_round.taylor = series_round
+floor.taylor = series_rounding(np.floor)
+ceil.taylor = series_rounding(np.ceil)
+trunc.taylor = series_rounding(np.trunc)
+floordiv.taylor = series_floordiv
+exp.taylor = series_exp_rule
+log.taylor = series_log_rule
+sin.taylor = lambda a: series_sincos(a)[0]
+cos.taylor = lambda a: series_sincos(a)[1]
+tan.taylor = lambda a: series_div(*series_sincos(a))
+arcsin.taylor = lambda a: series_inverse_trig(a, np.arcsin)
+arccos.taylor = lambda a: series_inverse_trig(a, np.arccos)
+arctan.taylor = series_arctan
+sinh.taylor = lambda a: series_sincos(a, 1)[0]
+cosh.taylor = lambda a: series_sincos(a, 1)[1]
+tanh.taylor = lambda a: series_div(*series_sincos(a, 1))
+logistic.taylor = series_logistic
+sigmoid.taylor = lambda a: series_logistic(a, series_constant(1, a), series_constant(1, a))
+
+# Functions that do not act elementwise on array valued Nodes
+
+def index_derivative(x, key):
+    # Derivative has the seed axes in front of the value axes: index the value axes only
+    if np.ndim(x.d) == 0:
+        return x.d
+    extra = np.ndim(x.d) - np.ndim(x.v)
+    return x.d[(slice(None),) * extra + key]
+
+def index_adjoint(g, x, key):
+    # Scatter the back-gradient into the indexed positions
+    back = np.zeros(np.shape(g)[:1] + np.shape(x.v))
+    np.add.at(back, (slice(None),) + key, g)
+    return (back,)
+
+def index(x, key):
+    '''Returns x[key] for an array valued Node x, as a new Node'''
+    if not isinstance(key, tuple):
+        key = (key,)
+    return BaseFunction(lambda x: x.v[key], lambda x: index_derivative(x, key),
+                        lambda g, x: index_adjoint(g, x, key))(x)
+
+def sum_derivative(x):
+    if np.ndim(x.d) == 0:
+        return x.d * np.size(x.v)
+    # Sum over the value axes, keeping the seed axes
+    return np.sum(x.d, axis=tuple(range(np.ndim(x.d) - np.ndim(x.v), np.ndim(x.d))))
+
+def sum_adjoint(g, x):
+    # Every element gets the back-gradient of the sum
+    g = np.asarray(g)
+    return (np.broadcast_to(g.reshape(g.shape + (1,) * np.ndim(x.v)), g.shape + np.shape(x.v)),)
+
+# Sum of all the elements of an array valued Node
+_sum = BaseFunction(lambda x: np.sum(x.v), sum_derivative, sum_adjoint)
+
+def prod_derivative(x):
+    others = products_of_others(np.ravel(x.v)).reshape(np.shape(x.v))
+    if np.ndim(x.d) == 0:
+        return x.d * np.sum(others)
+    return np.sum(x.d * others, axis=tuple(range(np.ndim(x.d) - np.ndim(x.v), np.ndim(x.d))))
+
+def prod_adjoint(g, x):
+    others = products_of_others(np.ravel(x.v)).reshape(np.shape(x.v))
+    g = np.asarray(g)
+    return (g.reshape(g.shape + (1,) * np.ndim(x.v)) * others,)
+
+# Product of all the elements of an array valued Node
+_prod = BaseFunction(lambda x: np.prod(x.v), prod_derivative, prod_adjoint)
+
+# Matrix product of array valued Nodes (1-D or 2-D, as np.matmul). 1-D arguments are made
+# a row (left) or a column (right), so that the seed and back-gradient axes in front are
+# broadcast by np.matmul, and the added axis is dropped from the result again
+def as_matrices(a, b):
+    A, B = np.asarray(a), np.asarray(b)
+    return (A.reshape(1, -1) if A.ndim == 1 else A), (B.reshape(-1, 1) if B.ndim == 1 else B)
+
+def matmul_derivative(a, b):
+    A, B = as_matrices(a.v, b.v)
+    shape = np.shape(np.matmul(a.v, b.v))
+    # The derivatives come aligned as for elementwise functions (see align_derivatives):
+    # the seed axes, axes of length 1 if needed, then the value axes
+    seed = max(np.ndim(a.v), np.ndim(b.v))
+    d = 0
+    if np.ndim(a.d):
+        lead = np.shape(a.d)[:np.ndim(a.d) - seed]
+        d = d + np.matmul(np.reshape(a.d, lead + A.shape), B).reshape(lead + shape)
+    if np.ndim(b.d):
+        lead = np.shape(b.d)[:np.ndim(b.d) - seed]
+        d = d + np.matmul(A, np.reshape(b.d, lead + B.shape)).reshape(lead + shape)
+    return d
+
+def matmul_adjoint(g, a, b):
+    A, B = as_matrices(a.v, b.v)
+    g = np.asarray(g)
+    lead = g.shape[:g.ndim - (np.ndim(a.v) + np.ndim(b.v) - 2)]
+    g = g.reshape(lead + (A.shape[0], B.shape[1]))
+    return (np.matmul(g, B.T).reshape(lead + np.shape(a.v)),
+            np.matmul(A.T, g).reshape(lead + np.shape(b.v)))
+
+_matmul = BaseFunction(lambda a, b: np.matmul(a.v, b.v), matmul_derivative, matmul_adjoint)
+
+def stack_derivative(xs, shape):
+    # Seed axes first, then the value axes
+    d = stack_derivatives(xs)
+    return np.moveaxis(d, 0, -1).reshape(d.shape[1:] + shape)
+
+def stack_adjoint(g, xs, shape):
+    g = np.asarray(g)
+    g = g.reshape(g.shape[:g.ndim - len(shape)] + (-1,))
+    return tuple(g[..., k] for k in range(len(xs)))
+
+def stack(x):
+    '''Returns a single array valued Node holding the values of an np.array (or list) of
+    scalar Nodes and numbers, so that operations on it are vectorized numpy calls'''
+    x = np.asarray(x, dtype=object)
+    shape = x.shape
+    return BaseFunction(lambda *xs: values_of(xs).reshape(shape),
+                        lambda *xs: stack_derivative(xs, shape),
+                        lambda g, *xs: stack_adjoint(g, xs, shape))(*x.ravel())
+
+# N-ary functions of sequences (lists or np.arrays) of Nodes. Each is a single Node of all
+# the elements, computed with one numpy call, instead of a chain of binary operations. The
+# elements are reduced along the first axis only: elements holding arrays (as in grad_batch
+# or with vectorize=True) are combined elementwise, as a chain of + or * would
+
+def values_of(xs):
+    values = [x.v for x in xs]
+    shapes = set(np.shape(v) for v in values)
+    if len(shapes) > 1:
+        shape = np.broadcast_shapes(*shapes)
+        values = [np.broadcast_to(v, shape) for v in values]
+    return np.array(values)
+
+def stack_derivatives(xs):
+    '''(n,) + seed_shape + value shape array of the derivatives of the Nodes xs, whose
+    derivatives are aligned (see align_derivatives)'''
+    ds = [x.d for x in xs]
+    # Derivatives are either of the seed and value shape or 0 (constants)
+    shape = np.broadcast_shapes(*[np.shape(d) for d in ds])
+    return np.array([np.broadcast_to(d, shape) for d in ds])
+
+def weighted_sum(w, ds):
+    '''Sum of w[k] * ds[k] over the elements, for weights w of shape (n,) + value shape and
+    derivatives ds from stack_derivatives'''
+    extra = ds.ndim - w.ndim
+    if extra < 0:
+        # Only constants
+        return 0.
+    return np.sum(w.reshape(w.shape[:1] + (1,) * extra + w.shape[1:]) * ds, axis=0)
+
+# Products of all the values but one, without dividing (values can be 0)
+def products_of_others(v):
+    ones = np.ones_like(v[:1])
+    before = np.concatenate((ones, np.cumprod(v, axis=0)[:-1]))
+    after = np.concatenate((np.cumprod(v[::-1], axis=0)[::-1][1:], ones))
+    return before * after
+
+def logsumexp_value(v):
+    # Shifted by the maximum, so that the exponentials do not overflow
+    top = np.max(v, axis=0)
+    return top + np.log(np.sum(np.exp(v - top), axis=0))
+
+# Weights of the elements in the derivative of logsumexp (softmax)
+def logsumexp_weights(v):
+    return np.exp(v - logsumexp_value(v))
+
+nary_sum = BaseFunction(lambda *xs: np.sum(values_of(xs), axis=0),
+                        lambda *xs: np.sum(stack_derivatives(xs), axis=0),
+                        lambda g, *xs: (g,) * len(xs))
+nary_prod = BaseFunction(lambda *xs: np.prod(values_of(xs), axis=0),
+                         lambda *xs: weighted_sum(products_of_others(values_of(xs)), stack_derivatives(xs)),
+                         lambda g, *xs: tuple(g * p for p in products_of_others(values_of(xs))))
+nary_mean = BaseFunction(lambda *xs: np.mean(values_of(xs), axis=0),
+                         lambda *xs: np.mean(stack_derivatives(xs), axis=0),
+                         lambda g, *xs: (g / len(xs),) * len(xs))
+nary_logsumexp = BaseFunction(lambda *xs: logsumexp_value(values_of(xs)),
+                              lambda *xs: weighted_sum(logsumexp_weights(values_of(xs)), stack_derivatives(xs)),
+                              lambda g, *xs: tuple(g * w for w in logsumexp_weights(values_of(xs))))
+
+# Dot product of a and b, given as the elements of a followed by the elements of b
+def dot_derivative(*xs):
+    n = len(xs) // 2
+    return weighted_sum(values_of(xs[n:]), stack_derivatives(xs[:n])) + \
+        weighted_sum(values_of(xs[:n]), stack_derivatives(xs[n:]))
+
+def dot_adjoint(g, *xs):
+    n = len(xs) // 2
+    return tuple(g * b for b in values_of(xs[n:])) + tuple(g * a for a in values_of(xs[:n]))
+
+nary_dot = BaseFunction(lambda *xs: np.sum(values_of(xs[:len(xs) // 2]) * values_of(xs[len(xs) // 2:]), axis=0),
+                        dot_derivative, dot_adjoint)
+
+def nsum(x):
+    '''Sum of a sequence of Nodes (or numbers), as a single Node. Named nsum so that it does
+    not shadow the builtin sum; for an array valued Node use x.sum()'''
+    return nary_sum(*x)
+
+def prod(x):
+    '''Product of a sequence of Nodes, as a single Node'''
+    return nary_prod(*x)
+
+def mean(x):
+    '''Mean of a sequence of Nodes, as a single Node'''
+    return nary_mean(*x)
+
+def logsumexp(x):
+    '''log(sum(exp(x))) of a sequence of Nodes, as a single Node, computed without overflow'''
+    return nary_logsumexp(*x)
+
+def dot(a, b):
+    '''Dot product of two sequences of Nodes of the same length, as a single Node'''
+    if len(a) != len(b):
+        raise ValueError('dot needs two sequences of the same length')
+    return nary_dot(*a, *b)
+
+def matmul(A, B):
+    '''Matrix product of 2-D (or 1-D) arrays of Nodes, as an np.array with one Node per
+    element, each a single dot product'''
+    A, B = np.asarray(A, dtype=object), np.asarray(B, dtype=object)
+    if A.ndim not in (1, 2) or B.ndim not in (1, 2):
+        raise ValueError('matmul needs 1-D or 2-D arrays')
+    A2 = A.reshape(1, -1) if A.ndim == 1 else A
+    B2 = B.reshape(-1, 1) if B.ndim == 1 else B
+    if A2.shape[1] != B2.shape[0]:
+        raise ValueError('matmul shapes do not match')
+    C = np.empty((A2.shape[0], B2.shape[1]), dtype=object)
+    for i in range(C.shape[0]):
+        for j in range(C.shape[1]):
+            C[i, j] = dot(A2[i], B2[:, j])
+    # Drop the axes added to 1-D arguments, as np.matmul does
+    if A.ndim == 1:
+        C = C[0]
+    if B.ndim == 1:
+        C = C[..., 0]
+    return C
+
+def series_nsum(*a):
+    return np.sum(a, axis=0)
+
+def series_prod(*a):
+    c = a[0]
+    for b in a[1:]:
+        c = series_mul(c, b)
+    return c
+
+def series_dot(*a):
+    n = len(a) // 2
+    return np.sum([series_mul(x, y) for x, y in zip(a[:n], a[n:])], axis=0)
+
+nary_sum.taylor = series_nsum
+nary_prod.taylor = series_prod
+nary_mean.taylor = lambda *a: np.mean(a, axis=0)
+nary_logsumexp.taylor = lambda *a: series_log(np.sum([series_exp(x) for x in a], axis=0))
+nary_dot.taylor = series_dot
@@ -14,14 +14,16 @@ def count_recursive(args):
     return total
     
 def count_recursive_recursion_part(args):
+    # Walks nested sequences with an explicit stack instead of recursing
     total = 0
-    if hasattr(type(args), '__len__'):
-        # object is a sequence
-
-        for x in args:
-            total += count_recursive_recursion_part(x)
-    else:
-        total += 1
+    stack = [args]
+    while stack:
+        x = stack.pop()
+        if hasattr(type(x), '__len__') and not isinstance(x, str):
+            # object is a sequence (strings would never stop splitting into strings)
+            stack.extend(x)
+        else:
+            total += 1
     return total
 
 def unpack(args):
@@ -45,23 +47,43 @@ def unpack(args):
     return l
     
 def unpack_recursion_part(args):
+    # Walks nested sequences with an explicit stack instead of recursing.
+    # Sequences are pushed reversed so that items come out in their original order
     l = []
-      
-    if hasattr(type(args), '__len__'):
-        # object is a sequence
-        for x in args:
-            l += unpack_recursion_part(x)
-    else:
-        l.append(args)
-
+    stack = [args]
+    while stack:
+        x = stack.pop()
+        if hasattr(type(x), '__len__') and not isinstance(x, str):
+            # object is a sequence (strings would never stop splitting into strings)
+            stack.extend(reversed(list(x)))
+        else:
+            l.append(x)
     return l
 
-def nodify(args, seed):
-    '''Recursively transforms all numerical values in np.arrays and lists into Node objects'''
+def check_numeric(*values):
+    '''Raises TypeError unless all values (scalars or arrays) are real numbers'''
+    for x in values:
+        try:
+            np.asarray(x, dtype=np.float64)
+        except:
+            raise TypeError('Value and derivative must be numeric.')
+
+def nodify(args, seed, validate=True, vectorize=False):
+    '''Recursively transforms all numerical values in np.arrays and lists into Node objects
+
+    The inputs are the boundary of the graph: they and the seed are verified to be numeric
+    here, once per argument, so that the Nodes themselves can skip the check. Pass
+    validate=False to skip it, in which case both are trusted.
+
+    With vectorize=True each np.array becomes a single Node holding the whole array, with
+    derivative of shape seed_width + array.shape, instead of one Node per element.
+    '''
     if isinstance(args, (np.ndarray, list, tuple)):
         pass
     else:
         raise TypeError('The input argument should be either np.arrays or list')
+    if validate:
+        check_numeric(seed, *args)
     i = 0
     new_args = []
     for a in args:
@@ -70,11 +92,19 @@ def nodify(args, seed):
             # Deferred import to work around circular dependencies
             from .base import Node
             nonlocal i
-            node = Node(x, seed[i])
+            node = Node(x, seed[i], check=False)
             i += 1
             return node
 
-        if isinstance(a, np.ndarray):
+        if isinstance(a, np.ndarray) and vectorize:
+            from .base import Node
+            rows = np.asarray(seed[i:i + a.size])
+            i += a.size
+            # Seed rows of the elements, moved behind the seed axes and reshaped like a
+            d = np.moveaxis(rows, 0, -1).reshape(rows.shape[1:] + a.shape)
+            new_args.append(Node(a.astype(np.float64), d, check=False))
+
+        elif isinstance(a, np.ndarray):
             new_args.append(np.array([agument(x) for x in a]))
             #code below does not work because vectorize can call agument more than len(a) times
             #new_args.append(np.vectorize(agument)(a)) 
@@ -86,10 +116,101 @@ def nodify(args, seed):
             new_args.append(agument(a))
     return new_args
 
+def flat_args(args, vectorize=False):
+    '''Input values in the order nodify turns them into Nodes'''
+    values = []
+    for a in args:
+        if isinstance(a, np.ndarray) and not vectorize or isinstance(a, list):
+            values.extend(a)
+        elif isinstance(a, np.ndarray):
+            values.append(a.astype(np.float64))
+        else:
+            values.append(a)
+    return values
+
+def input_structure(args, vectorize=False):
+    '''Describes the type and shape of the inputs: two sets of inputs with the same
+    structure are turned into Nodes in the same way'''
+    key = []
+    for a in args:
+        if isinstance(a, np.ndarray):
+            key.append(('array', a.shape))
+        elif isinstance(a, list):
+            key.append(('list', len(a)))
+        else:
+            key.append(('scalar',))
+    return (vectorize,) + tuple(key)
+
 def recursive_append(n, trace):
-    # appends a node and all its parents to trace by recursing
-    trace.append(n)
-    if n.parents is not None:
-        for p in n.parents:
-            recursive_append(p, trace)
+    # appends a node and all its parents to trace (depth first, one entry per path).
+    # Uses an explicit stack so deep graphs do not hit the recursion limit
+    stack = [n]
+    while stack:
+        x = stack.pop()
+        trace.append(x)
+        if x.parents is not None:
+            stack.extend(reversed(x.parents))
+
+def topological_sort(outputs):
+    '''Returns every Node reachable from outputs exactly once, ordered so that each Node
+    comes before all of its parents (i.e. reverse topological order of evaluation).
+
+    Uses an explicit stack, so graphs deeper than the recursion limit are fine.
+    '''
+    visited = set()
+    order = []
+    for out in outputs:
+        if id(out) in visited:
+            continue
+        visited.add(id(out))
+        # Each stack entry holds a node and an iterator over its remaining parents
+        stack = [(out, iter(out.parents or ()))]
+        while stack:
+            node, parents = stack[-1]
+            for p in parents:
+                if id(p) not in visited:
+                    visited.add(id(p))
+                    stack.append((p, iter(p.parents or ())))
+                    break
+            else:
+                # All parents done: node is finished (post-order)
+                stack.pop()
+                order.append(node)
+    order.reverse()
+    return order
+
+def align_derivatives(args):
+    '''Returns Nodes whose derivatives broadcast against each other like their values.
+
+    Derivatives have shape seed_width + value.shape, so when values of different dimension
+    are combined (e.g. a scalar Node and an array Node) the seed axis of the lower dimensional
+    one must be followed by extra axes of length 1. Returns args unchanged when all values
+    are scalars.
+    '''
+    if not any(isinstance(a.v, np.ndarray) and a.v.ndim for a in args):
+        return args
+    from .base import Node
+    ndim = max(np.ndim(a.v) for a in args)
+    aligned = []
+    for a in args:
+        v_ndim = np.ndim(a.v)
+        extra = np.ndim(a.d) - v_ndim
+        if extra > 0 and v_ndim < ndim:
+            d = np.reshape(a.d, np.shape(a.d)[:extra] + (1,) * (ndim - v_ndim) + np.shape(a.v))
+            a = Node(a.v, d, check=False)
+        aligned.append(a)
+    return aligned
 
+def unbroadcast(g, shape):
+    '''Sums a back-gradient of shape (m,) + out.shape down to (m,) + shape, undoing the
+    broadcasting of an argument with value shape `shape` into the output'''
+    if np.ndim(g) <= 1 + len(shape):
+        if np.ndim(g) < 1 + len(shape) or np.shape(g)[1:] == tuple(shape):
+            return g
+    # Leading axes that broadcasting added
+    g = np.sum(g, axis=tuple(range(1, np.ndim(g) - len(shape))))
+    # Axes of length 1 that were stretched
+    axes = tuple(i + 1 for i, k in enumerate(shape) if k == 1 and g.shape[i + 1] != 1)
+    if axes:
+        g = np.sum(g, axis=axes, keepdims=True)
+    return g
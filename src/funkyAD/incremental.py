@@ -0,0 +1,142 @@
+import heapq
+import numpy as np
+from .tape import INPUT, CONST
+
+class IncrementalTape():
+    '''Keeps a recorded (finalized) scalar Tape with its values, the partial derivative of
+    every slot with respect to each of its arguments, and the back-gradients of every slot,
+    and updates them when some inputs change.
+
+    state = IncrementalTape(tape)
+    -   state.update(inputs): new value of every input slot, in order. Only the slots that
+        depend on an input whose value changed (the dirty slots) are evaluated again, with
+        their partials. Returns False, as Tape.replay, when a recorded comparison has a
+        different outcome (the tape must then be recorded again), True otherwise.
+        state.recomputed holds the number of slots evaluated again.
+    -   state.jacobian(): the (m, n) Jacobian, from the stored back-gradients of the
+        inputs. Only the back-gradients that change are computed again from the stored
+        partials, without calling any BaseFunction: those of the arguments of operations
+        whose partials changed, then those of the arguments of every slot whose
+        back-gradient changed. state.swept holds the number of back-gradients computed.
+    '''
+
+    def __init__(self, tape):
+        if not tape.scalar:
+            raise ValueError('Incremental evaluation needs a tape of scalar Nodes')
+        from .base import View
+        self.tape = tape
+        self.op, self.ptr, self.idx = tape.op.tolist(), tape.ptr.tolist(), tape.idx.tolist()
+        self.values = tape.values.tolist()
+        # Slots computed from each slot, to find what depends on a changed input, and the
+        # entries of idx (hence of partials) linking them
+        self.children = [[] for _ in self.op]
+        edges = [[] for _ in self.op]
+        for i in range(len(self.op)):
+            for k in range(self.ptr[i], self.ptr[i + 1]):
+                self.children[self.idx[k]].append(i)
+                edges[self.idx[k]].append(k)
+        self.children_array = [np.array(c, dtype=np.int64) for c in self.children]
+        self.edges = [np.array(e, dtype=np.int64) for e in edges]
+        # Reused argument Nodes, as in Tape.reverse
+        self.views = [View() for _ in range(tape.max_arity)]
+        # Partial derivative of each slot along each of its arguments, one per entry of idx
+        self.partials = np.zeros(len(self.idx))
+        # Slots whose back-gradient may have changed
+        self.stale = set()
+        for i in range(len(self.op)):
+            if self.op[i] >= 0:
+                self._partials(i)
+        # Back-gradient of each output slot from the outputs (rows of the identity)
+        m = len(tape.outputs)
+        self.seeds = {}
+        for k, i in enumerate(tape.outputs):
+            self.seeds.setdefault(i, np.zeros(m))[k] += 1
+        self.adj = np.zeros((len(self.op), m))
+        for i in range(len(self.op) - 1, -1, -1):
+            self._sweep(i)
+        self.stale = set()
+        self.recomputed = 0
+        self.swept = len(self.op)
+
+    def _arguments(self, i):
+        parents = self.idx[self.ptr[i]:self.ptr[i + 1]]
+        args = self.views[:len(parents)]
+        for view, j in zip(args, parents):
+            view.v = self.values[j]
+            view.constant = self.op[j] == CONST
+        return args
+
+    def _partials(self, i):
+        contributions = self.tape.functions[self.op[i]].vjp(1.0, *self._arguments(i))
+        for k, c in zip(range(self.ptr[i], self.ptr[i + 1]), contributions):
+            c = float(c)
+            if c != self.partials[k]:
+                self.partials[k] = c
+                # The back-gradient of that argument has to be computed again
+                self.stale.add(self.idx[k])
+
+    def _sweep(self, i):
+        '''Computes the back-gradient of slot i from those of its children. Returns whether
+        it changed'''
+        g = self.partials[self.edges[i]] @ self.adj[self.children_array[i]]
+        seed = self.seeds.get(i)
+        if seed is not None:
+            g = g + seed
+        if np.array_equal(g, self.adj[i]):
+            return False
+        self.adj[i] = g
+        return True
+
+    def update(self, inputs):
+        values = self.values
+        changed = []
+        for i, v in zip(self.tape.inputs, inputs):
+            if values[i] != v:
+                values[i] = float(v)
+                changed.append(i)
+
+        # Slots downstream of the changed inputs, in evaluation order
+        dirty = set(changed)
+        stack = list(changed)
+        while stack:
+            for c in self.children[stack.pop()]:
+                if c not in dirty:
+                    dirty.add(c)
+                    stack.append(c)
+        dirty = sorted(i for i in dirty if self.op[i] != INPUT)
+        self.recomputed = len(dirty)
+
+        # Comparisons of unchanged slots keep their outcome: only check the others, before
+        # the slots recorded after them (as Tape.replay does)
+        touched = set(changed).union(dirty)
+        guards = [g for g in self.tape.guards if g[2] in touched or g[3] in touched]
+        k = 0
+        for i in dirty + [len(self.op)]:
+            while k < len(guards) and guards[k][0] <= i:
+                _, compare, a, b, result = guards[k]
+                if values[a] == values[b] or bool(compare(values[a], values[b])) != result:
+                    return False
+                k += 1
+            if i < len(self.op):
+                values[i] = float(self.tape.functions[self.op[i]].f(*self._arguments(i)))
+                self._partials(i)
+        return True
+
+    def jacobian(self):
+        # Back-gradients are computed again, from the last slot to the first, for the slots
+        # with a child whose partial changed, then for the parents of every slot whose
+        # back-gradient changed
+        stale = [-i for i in self.stale]
+        heapq.heapify(stale)
+        self.stale = set()
+        self.swept = 0
+        while stale:
+            i = -heapq.heappop(stale)
+            # Skip the duplicates
+            while stale and stale[0] == -i:
+                heapq.heappop(stale)
+            self.swept += 1
+            if self._sweep(i):
+                for j in self.idx[self.ptr[i]:self.ptr[i + 1]]:
+                    heapq.heappush(stale, -j)
+        return self.adj[self.tape.inputs].T.copy()
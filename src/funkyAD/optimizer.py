@@ -0,0 +1,92 @@
+import numpy as np
+from .tape import Tape, INPUT, CONST
+
+def _constant_key(v):
+    # Constants are merged when they have the same type, shape and bytes (so that e.g.
+    # 0.0 and -0.0 stay apart). Other values, e.g. Nodes, are never merged
+    if isinstance(v, np.ndarray):
+        if v.dtype == object:
+            return None
+    elif not np.isscalar(v):
+        return None
+    a = np.asarray(v)
+    return ('const', a.dtype.str, a.shape, a.tobytes())
+
+def optimize_tape(tape):
+    '''Returns an equivalent, smaller copy of a recorded (finalized) Tape, and a report of
+    what was removed.
+
+    - constant folding: operations whose arguments are all constants become constants
+        holding their recorded value.
+    - common subexpressions: equal constants, and the same BaseFunction applied to the same
+        slots, are merged into the first of them.
+    - dead slots: slots that neither the outputs nor the recorded comparisons depend on are
+        dropped. Inputs are always kept.
+
+    The report is a dict with the number of operations 'folded' into constants, and of
+    slots removed as 'merged' duplicates or as 'pruned' dead slots. The optimized tape
+    computes the same outputs and derivatives with replay, reverse, tangents and taylor,
+    and checks the same comparisons.
+    '''
+    op, ptr, idx = tape.op.tolist(), tape.ptr.tolist(), tape.idx.tolist()
+    size = len(op)
+
+    # Forward pass: fold constants and merge duplicates. same[i] is the slot computing
+    # the value of slot i (i itself unless it was merged)
+    same = list(range(size))
+    new_op = list(op)
+    parents = [()] * size
+    first = {}
+    folded = merged = 0
+    for i in range(size):
+        args = tuple(same[j] for j in idx[ptr[i]:ptr[i + 1]])
+        if op[i] >= 0 and all(new_op[j] == CONST for j in args):
+            new_op[i] = CONST
+            args = ()
+            folded += 1
+        parents[i] = args
+        if new_op[i] == CONST:
+            key = _constant_key(tape.values[i])
+        elif new_op[i] == INPUT:
+            key = None
+        else:
+            key = (new_op[i], args)
+        if key is not None:
+            j = first.setdefault(key, i)
+            if j != i:
+                same[i] = j
+                merged += 1
+
+    # Reverse pass: keep what the outputs and comparisons depend on
+    outputs = [same[i] for i in tape.outputs]
+    guards = [(position, compare, same[a], same[b], result)
+              for position, compare, a, b, result in tape.guards]
+    live = [False] * size
+    for i in outputs + [g[2] for g in guards] + [g[3] for g in guards] + tape.inputs:
+        live[i] = True
+    for i in range(size - 1, -1, -1):
+        if live[i]:
+            for j in parents[i]:
+                live[j] = True
+    keep = [i for i in range(size) if live[i]]
+    pruned = size - merged - len(keep)
+
+    # Renumber the kept slots
+    new_index = {i: k for k, i in enumerate(keep)}
+    # Kept slots before each position, to move the comparisons
+    before = np.concatenate(([0], np.cumsum(live))).tolist()
+
+    optimized = Tape()
+    optimized.nodes = None
+    optimized.functions = tape.functions
+    optimized.op = np.array([new_op[i] for i in keep], dtype=np.int32)
+    optimized.idx = np.array([new_index[j] for i in keep for j in parents[i]], dtype=np.int64)
+    optimized.ptr = np.concatenate(([0], np.cumsum([len(parents[i]) for i in keep]))).astype(np.int64)
+    optimized.values = tape.values[keep]
+    optimized.inputs = [new_index[i] for i in tape.inputs]
+    optimized.outputs = [new_index[i] for i in outputs]
+    optimized.guards = [(before[position], compare, new_index[a], new_index[b], result)
+                        for position, compare, a, b, result in guards]
+    optimized.scalar = tape.scalar
+    optimized.max_arity = max([len(parents[i]) for i in keep], default=0)
+    return optimized, {'folded': folded, 'merged': merged, 'pruned': pruned}
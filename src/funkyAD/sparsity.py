@@ -0,0 +1,116 @@
+import numpy as np
+
+from .functions import addition, subtraction, pos, neg, multiplication
+
+def _dependencies(tape):
+    '''Set of the inputs (numbered in order) each slot of a scalar Tape depends on'''
+    if not tape.scalar:
+        raise ValueError('Sparsity detection needs a tape of scalar Nodes')
+    ptr, idx = tape.ptr.tolist(), tape.idx.tolist()
+    inputs = {slot: k for k, slot in enumerate(tape.inputs)}
+    empty = frozenset()
+    deps = []
+    for i in range(len(tape)):
+        if i in inputs:
+            deps.append(frozenset([inputs[i]]))
+            continue
+        parents = idx[ptr[i]:ptr[i + 1]]
+        if not parents:
+            deps.append(empty)
+        elif len(parents) == 1:
+            deps.append(deps[parents[0]])
+        else:
+            deps.append(frozenset().union(*(deps[j] for j in parents)))
+    return deps
+
+def jacobian_sparsity(tape):
+    '''Structural nonzeros of the Jacobian of a recorded (finalized) scalar Tape.
+
+    Propagates, from the inputs to the outputs, the set of inputs each slot depends on.
+    Returns rows, cols: integer arrays such that only J[rows[k], cols[k]] can be nonzero
+    (an output depending on an input through e.g. floor is still counted).
+    '''
+    deps = _dependencies(tape)
+    rows, cols = [], []
+    for r, slot in enumerate(tape.outputs):
+        for c in sorted(deps[slot]):
+            rows.append(r)
+            cols.append(c)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+def hessian_sparsity(tape):
+    '''Structural nonzeros of the Hessian of the outputs of a recorded scalar Tape.
+
+    Every nonlinear operation the outputs depend on makes the inputs its arguments depend
+    on interact: all pairs of them, or only pairs across the two factors for products.
+    Linear operations (+, -) add no interaction. Returns rows, cols as jacobian_sparsity,
+    a symmetric pattern.
+    '''
+    deps = _dependencies(tape)
+    ptr, idx = tape.ptr.tolist(), tape.idx.tolist()
+    op = tape.op.tolist()
+    linear = [f in (addition, subtraction, pos, neg) for f in tape.functions]
+
+    # Slots the outputs depend on
+    needed = [False] * len(op)
+    for i in tape.outputs:
+        needed[i] = True
+    for i in range(len(op) - 1, -1, -1):
+        if needed[i]:
+            for j in idx[ptr[i]:ptr[i + 1]]:
+                needed[j] = True
+
+    pairs = set()
+    for i in range(len(op)):
+        if not needed[i] or op[i] < 0 or linear[op[i]]:
+            continue
+        parents = idx[ptr[i]:ptr[i + 1]]
+        if tape.functions[op[i]] is multiplication:
+            a, b = deps[parents[0]], deps[parents[1]]
+            pairs.update((r, c) for r in a for c in b)
+            pairs.update((r, c) for r in b for c in a)
+        else:
+            both = frozenset().union(*(deps[j] for j in parents))
+            pairs.update((r, c) for r in both for c in both)
+    pairs = sorted(pairs)
+    rows = np.array([r for r, _ in pairs], dtype=np.int64)
+    cols = np.array([c for _, c in pairs], dtype=np.int64)
+    return rows, cols
+
+def color_columns(rows, cols, n):
+    '''Greedy coloring of the columns of a sparsity pattern: two columns with a nonzero in
+    the same row get different colors. Columns of one color can then share a forward mode
+    seed. Returns the color of each of the n columns, numbered from 0.
+
+    Rows are colored (for reverse mode) with color_columns(cols, rows, m).
+    '''
+    by_column = [[] for _ in range(n)]
+    by_row = {}
+    for r, c in zip(rows.tolist(), cols.tolist()):
+        by_column[c].append(r)
+        by_row.setdefault(r, []).append(c)
+    colors = np.full(n, -1, dtype=np.int64)
+    for c in range(n):
+        used = {colors[other] for r in by_column[c] for other in by_row[r]}
+        color = 0
+        while color in used:
+            color += 1
+        colors[c] = color
+    return colors
+
+def compression_seed(colors):
+    '''Seed matrix of shape (n, number of colors), with a 1 in column colors[k] of row k'''
+    width = int(colors.max()) + 1 if len(colors) else 0
+    seed = np.zeros((len(colors), width))
+    seed[np.arange(len(colors)), colors] = 1
+    return seed
+
+def to_sparse(data, rows, cols, shape):
+    '''Sparse matrix from COO triplets: a scipy.sparse csr_matrix if scipy is installed,
+    otherwise the triplets themselves as (data, (rows, cols)), the format accepted by the
+    scipy.sparse constructors'''
+    try:
+        from scipy.sparse import csr_matrix
+    except ImportError:
+        return data, (rows, cols)
+    return csr_matrix((data, (rows, cols)), shape=shape)
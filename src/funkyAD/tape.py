@@ -0,0 +1,262 @@
+import threading
+from contextlib import contextmanager
+import numpy as np
+from .helpers import unbroadcast
+
+# Opcodes of the slots that are not computed by a BaseFunction
+INPUT = -1
+CONST = -2
+
+# Tape currently recording, if any. Thread local so that threads record separately
+_active = threading.local()
+
+def current_tape():
+    '''Returns the Tape currently recording in this thread, or None'''
+    return getattr(_active, 'tape', None)
+
+@contextmanager
+def paused():
+    '''Stops recording in this thread for the duration of the block'''
+    previous = current_tape()
+    _active.tape = None
+    try:
+        yield
+    finally:
+        _active.tape = previous
+
+class Tape():
+    '''Flat record of an evaluation, built while the function runs on Node objects.
+
+    with Tape() as tape:
+        out = f(*nodes)
+    -   every Node created by a BaseFunction inside the block gets a slot on the tape.
+        Nodes used as arguments without having a slot (constants) get one too.
+
+    After finalize(), the evaluation is stored as a struct of arrays rather than a graph:
+    - op: opcode of each slot, an index into tape.functions, or INPUT / CONST
+    - ptr, idx: the parents of slot i are idx[ptr[i]:ptr[i + 1]] (slots always come after
+        their parents, so the slot order is an evaluation order)
+    - values: value of each slot. A float64 array when all values are scalars, otherwise an
+        object array (e.g. with array valued Nodes)
+    - inputs, outputs: slots of the inputs and outputs, in order
+    - guards: comparisons between Nodes made while recording, (position, operator, slot a,
+        slot b, result). They are the data dependent branches of the function: replay()
+        re-checks them to detect when the tape no longer matches the function.
+    '''
+
+    def __init__(self):
+        self.functions = []
+        self._codes = {}
+        # Recorded Nodes, only kept while recording to look up their slot
+        self.nodes = []
+        self.op = []
+        self.ptr = [0]
+        self.idx = []
+        self.values = []
+        self.inputs = []
+        self.outputs = []
+        self.guards = []
+        self.scalar = True
+        self.max_arity = 0
+
+    def __enter__(self):
+        self._previous = current_tape()
+        _active.tape = self
+        return self
+
+    def __exit__(self, *exc):
+        _active.tape = self._previous
+
+    def __len__(self):
+        return len(self.op)
+
+    def _append(self, node, op, parents=()):
+        node.i = len(self.nodes)
+        self.nodes.append(node)
+        self.op.append(op)
+        self.idx.extend(parents)
+        self.ptr.append(len(self.idx))
+        self.values.append(node.v)
+        if self.scalar and isinstance(node.v, np.ndarray) and node.v.ndim:
+            self.scalar = False
+        return node.i
+
+    def slot(self, node):
+        '''Returns the slot of node, recording it as a constant if it has none'''
+        i = node.i
+        if i is not None and i < len(self.nodes) and self.nodes[i] is node:
+            return i
+        return self._append(node, CONST)
+
+    def record(self, node):
+        '''Records a Node computed by the BaseFunction node.f from node.parents'''
+        parents = [self.slot(p) for p in node.parents]
+        code = self._codes.get(id(node.f))
+        if code is None:
+            code = self._codes[id(node.f)] = len(self.functions)
+            self.functions.append(node.f)
+        self.max_arity = max(self.max_arity, len(parents))
+        self._append(node, code, parents)
+
+    def guard(self, op, a, b, result):
+        '''Records the outcome of the comparison op(a.v, b.v) between two Nodes'''
+        self.guards.append((len(self.op), op, self.slot(a), self.slot(b), bool(result)))
+
+    def record_inputs(self, nodes):
+        '''Marks nodes as the inputs, in order'''
+        for node in nodes:
+            i = self.slot(node)
+            self.op[i] = INPUT
+            self.inputs.append(i)
+
+    def record_outputs(self, nodes):
+        self.outputs = [self.slot(node) for node in nodes]
+
+    def finalize(self):
+        '''Converts the record into flat arrays and drops the references to the Nodes'''
+        self.nodes = None
+        self.op = np.array(self.op, dtype=np.int32)
+        self.ptr = np.array(self.ptr, dtype=np.int64)
+        self.idx = np.array(self.idx, dtype=np.int64)
+        values = self.values
+        if self.scalar:
+            try:
+                self.values = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                self.scalar = False
+        if not self.scalar:
+            self.values = np.empty(len(values), dtype=object)
+            self.values[:] = values
+        return self
+
+    def replay(self, inputs):
+        '''Re-evaluates every slot from new input values (one per input slot), in place.
+
+        Returns False as soon as a recorded comparison has a different outcome (or becomes
+        an equality), i.e. the function would have taken another branch: the tape must then
+        be recorded again. Returns True otherwise.
+        '''
+        from .base import View
+        values = self.values
+        for i, v in zip(self.inputs, inputs):
+            values[i] = v
+        op, ptr, idx = self.op.tolist(), self.ptr.tolist(), self.idx.tolist()
+        guards = iter(self.guards)
+        guard = next(guards, None)
+        views = [View() for _ in range(self.max_arity)]
+        for i in range(len(op) + 1):
+            # Check the comparisons made before slot i was recorded
+            while guard is not None and guard[0] == i:
+                _, compare, a, b, result = guard
+                if values[a] == values[b] or bool(compare(values[a], values[b])) != result:
+                    return False
+                guard = next(guards, None)
+            if i == len(op) or op[i] < 0:
+                continue
+            parents = idx[ptr[i]:ptr[i + 1]]
+            args = views[:len(parents)]
+            for view, j in zip(args, parents):
+                view.v = values[j]
+            values[i] = self.functions[op[i]].f(*args)
+        return True
+
+    def tangents(self, seeds):
+        '''Forward pass over the tape carrying derivatives: returns one Node per slot, with
+        derivative seeds[k] for input k (e.g. a direction v, or rows of the identity) and 0
+        for constants. Used for second order derivatives, as values for reverse().'''
+        from .base import Node
+        op, ptr, idx = self.op.tolist(), self.ptr.tolist(), self.idx.tolist()
+        nodes = [None] * len(op)
+        for i, d in zip(self.inputs, seeds):
+            nodes[i] = Node(self.values[i], d, check=False)
+        for i in range(len(op)):
+            if op[i] == CONST:
+                nodes[i] = Node(self.values[i], 0.0, check=False)
+            elif op[i] != INPUT:
+                nodes[i] = self.functions[op[i]](*[nodes[j] for j in idx[ptr[i]:ptr[i + 1]]])
+        return nodes
+
+    def taylor(self, series):
+        '''Propagates truncated Taylor series over the tape: series[k] is the array of
+        coefficients of input k, lowest order first, and constants are constant series.
+        Returns the series of every slot, computed with the taylor rules of the
+        BaseFunctions.'''
+        op, ptr, idx = self.op.tolist(), self.ptr.tolist(), self.idx.tolist()
+        like = np.asarray(series[0]) if len(series) else np.zeros(1)
+        values = [None] * len(op)
+        for i, a in zip(self.inputs, series):
+            values[i] = np.asarray(a, dtype=np.float64)
+        for i in range(len(op)):
+            if op[i] == CONST:
+                values[i] = np.zeros_like(like, dtype=np.float64)
+                values[i][0] = self.values[i]
+            elif op[i] != INPUT:
+                rule = self.functions[op[i]].taylor
+                if rule is None:
+                    raise ValueError('A function on the tape has no Taylor coefficient rule')
+                values[i] = rule(*[values[j] for j in idx[ptr[i]:ptr[i + 1]]])
+        return values
+
+    def reverse(self, seeds, values=None, retain=True):
+        '''Reverse sweep over the tape.
+
+        seeds: back-gradient of each output slot, of shape (m,) + value shape.
+        values: values of the slots to differentiate at, the recorded ones by default. With
+            the Nodes from tangents(), back-gradients are Nodes too, whose derivatives are
+            second order derivatives (forward over reverse).
+        retain: with retain=False, the back-gradient of each computed slot is freed as soon
+            as it has been propagated to its parents, so that only the back-gradients still
+            needed are alive at any time. Only those of inputs and constants are returned.
+        Returns the back-gradient of every slot: an (len(tape), m) float64 array for scalar
+        tapes, recorded values and retain=True, a list otherwise.
+        '''
+        # Deferred import to work around circular dependencies
+        from .base import View
+        scalar = self.scalar and values is None and retain
+        if values is None:
+            values = self.values
+        if scalar:
+            adj = np.zeros((len(self.op), len(seeds[0]) if seeds else 0))
+        else:
+            adj = [0] * len(self.op)
+        for i, g in zip(self.outputs, seeds):
+            adj[i] = adj[i] + g
+
+        # Plain lists are faster than numpy arrays for element by element access
+        op, ptr, idx = self.op.tolist(), self.ptr.tolist(), self.idx.tolist()
+        # Reused argument Nodes: only their value is read by the adjoint rules
+        views = [View() for _ in range(self.max_arity)]
+        for i in range(len(op) - 1, -1, -1):
+            code = op[i]
+            if code < 0:
+                continue
+            g = adj[i]
+            # Nothing to propagate (slots that received no back-gradient at all)
+            if type(g) is int:
+                continue
+            parents = idx[ptr[i]:ptr[i + 1]]
+            args = views[:len(parents)]
+            for view, j in zip(args, parents):
+                view.v = values[j]
+                view.constant = op[j] == CONST
+            contributions = self.functions[code].vjp(g, *args)
+            for j, c in zip(parents, contributions):
+                if scalar:
+                    adj[j] += c
+                else:
+                    adj[j] = adj[j] + unbroadcast(c, np.shape(values[j]))
+            if not retain:
+                # Slots only receive back-gradients from later slots: this one is complete
+                adj[i] = 0
+        return adj
+
+def record(f, *values):
+    '''Records f on a new Tape, called with one input Node per value (numbers or
+    np.arrays), and returns the finalized Tape. f returns the list of its outputs.'''
+    from .base import Node
+    nodes = [Node(v) for v in values]
+    with Tape() as tape:
+        out = f(*nodes)
+        tape.record_inputs(nodes)
+        tape.record_outputs(out)
+    return tape.finalize()
@@ -1,7 +1,8 @@
 import pytest
 import numpy as np
 from funkyAD.base import AD, grad, Node
-from funkyAD.functions import addition, multiplication, division, floordiv, power, sign, r_der, pos, neg, _abs, invert, _round, floor, ceil, trunc, exp, sin, cos, tan
+from funkyAD.helpers import topological_sort
+from funkyAD.functions import addition, multiplication, division, floordiv, power, sign, r_der, pos, neg, _abs, invert, _round, floor, ceil, trunc, exp, sin, cos, tan, tanh, sqrt, log, nsum, prod, logsumexp, dot, matmul, _matmul
 
 # to do:
 # deal with int, float, long 
@@ -35,15 +36,16 @@ def test_grad():
         return x**2 
     assert AD(f).grad(2)==[[4]]
 
-def test_trace():
+def test_tape():
     adobj = AD(lambda x,y: x+y)
-    trace = adobj._buildtrace(1,2)
-    assert len(trace)==3 
+    tape = adobj._record(1,2)
+    assert len(tape)==3 
 
-def test_trace_1dim():
+def test_tape_1dim():
+    # The input and the constant output
     adobj = AD(lambda x: 3)
-    trace = adobj._buildtrace(2)
-    assert len(trace)==1
+    tape = adobj._record(2)
+    assert len(tape)==2
 
 def test_reverse():
     def f(x):
@@ -257,4 +259,591 @@ def test_grad_new_function():
         return x ** 3
     assert grad(cube)(10) == [[300]]
 
+def test_tape_shared_node():
+    # x*x uses the same Node twice, it must only be recorded once
+    adobj = AD(lambda x: x*x + x)
+    tape = adobj._record(3)
+    assert len(tape) == 3
+    assert list(tape.idx[tape.ptr[1]:tape.ptr[2]]) == [0, 0]
+
+def test_topological_sort():
+    adobj = AD(lambda x, y: (x*y) + (x*y)*y)
+    adobj._record(2, 3)
+    trace = topological_sort(adobj.output_nodes)
+    position = {id(n): i for i, n in enumerate(trace)}
+    # Every node comes before its parents
+    for n in trace:
+        for p in n.parents or []:
+            assert position[id(n)] < position[id(p)]
+
+def test_reverse_repeated_parent():
+    adobj = AD(lambda x: x*x)
+    assert adobj._reverse(3) == [[6]]
+
+def test_reverse_shared_subexpression():
+    # Each step reuses the previous node twice: 2**60 paths but only 61 nodes
+    def f(x):
+        for _ in range(60):
+            x = x + x
+        return x
+    adobj = AD(f)
+    assert len(adobj._record(1)) == 61
+    assert adobj._reverse(1) == [[2.0**60]]
+
+def test_reverse_repeated_output():
+    adobj = AD(lambda x: [x, x])
+    assert (adobj._reverse(1) == [[1], [1]]).all()
+
+def test_reverse_deep_sum():
+    # Summing 5000 inputs builds a chain deeper than the default recursion limit
+    adobj = AD(lambda a: a.sum())
+    grad = adobj._reverse(np.arange(5000.))
+    assert grad.shape == (1, 5000)
+    assert (grad == 1).all()
+
+def test_reverse_without_adjoint():
+    # User-defined BaseFunction without adjoint rule falls back to its derivative
+    from funkyAD.functions import BaseFunction
+    prod = BaseFunction(lambda x, y: x.v * y.v, lambda x, y: x.d * y.v + x.v * y.d)
+    adobj = AD(lambda x, y: prod(x, prod(x, y)))
+    assert (adobj._reverse(2, 3) == [[12, 4]]).all()
+
+def test_reverse_does_not_modify_derivatives():
+    adobj = AD(lambda x, y: sin(x * y) + x)
+    adobj._reverse(1, 2)
+    assert all(np.all(n.d == 0) for n in topological_sort(adobj.output_nodes))
+
+def test_forward_single_evaluation():
+    calls = []
+    def f(x, y):
+        calls.append(1)
+        return [x * y, x + y]
+    adobj = AD(f)
+    grad = adobj.grad(2, 3)
+    assert len(calls) == 1
+    assert adobj.m == 2
+    assert (grad == [[3, 2], [1, 1]]).all()
+
+def test_node_slots():
+    node = Node(1, 2)
+    assert not hasattr(node, '__dict__')
+    with pytest.raises(AttributeError):
+        node.other = 3
+
+def test_node_no_check():
+    # Validation can be skipped for Nodes built from verified values
+    node = Node('Hello', 'World', check=False)
+    assert node.v == 'Hello'
+
+def test_validate_inputs():
+    with pytest.raises(TypeError):
+        AD(lambda x: x).grad('text')
+    with pytest.raises(TypeError):
+        AD(lambda x: x.sum()).grad(np.array(['a', 'b']))
+
+def test_no_validate_inputs():
+    adobj = AD(lambda x, y: x * y, validate=False)
+    assert (adobj.grad(2, 3) == [[3, 2]]).all()
+
+def test_reverse_power_negative_base_no_warning():
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert AD(lambda x: x**2)._reverse(-2.0) == [[-4]]
+
+def test_reverse_power_variable_exponent():
+    assert np.allclose(AD(lambda x, y: x**y)._reverse(2, 3), [[12, 8 * np.log(2)]])
+
+# Array valued Nodes
+def test_vectorize_single_node():
+    adobj = AD(lambda a: a, vectorize=True)
+    adobj._forward(np.array([1., 2., 3.]))
+    assert len(adobj.input_nodes) == 1
+    assert isinstance(adobj.input_nodes[0], Node)
+    assert adobj.input_nodes[0].shape == (3,)
+
+def test_vectorize_sum():
+    adobj = AD(lambda a: a.sum(), vectorize=True)
+    inp = np.arange(5.)
+    assert (adobj.grad(inp) == [[1, 1, 1, 1, 1]]).all()
+    adobj.set_mode('reverse')
+    assert (adobj.grad(inp) == [[1, 1, 1, 1, 1]]).all()
+
+def test_vectorize_elementwise():
+    def f(a, b):
+        return (sin(a) * b + a ** 2).sum()
+    a, b = np.array([0.5, 1.0, 2.0]), np.array([3.0, -1.0, 0.5])
+    truth = np.concatenate([np.cos(a) * b + 2 * a, np.sin(a)])
+    adobj = AD(f, vectorize=True)
+    assert np.allclose(adobj.grad(a, b), [truth])
+    adobj.set_mode('reverse')
+    assert np.allclose(adobj.grad(a, b), [truth])
+
+def test_vectorize_array_output():
+    f = lambda a, c: a * c
+    adobj = AD(f, vectorize=True)
+    truth = [[2, 0, 1], [0, 2, 2]]
+    assert adobj.grad(np.array([1., 2.]), 2.0).tolist() == truth
+    assert adobj.m == 2
+    adobj.set_mode('reverse')
+    assert adobj.grad(np.array([1., 2.]), 2.0).tolist() == truth
+
+def test_vectorize_index():
+    f = lambda a: [a[0] * a[1], a[1:].sum()]
+    adobj = AD(f, vectorize=True)
+    truth = [[3, 2, 0], [0, 1, 1]]
+    assert adobj.grad(np.array([2., 3., 4.])).tolist() == truth
+    adobj.set_mode('reverse')
+    assert adobj.grad(np.array([2., 3., 4.])).tolist() == truth
+
+def test_vectorize_2d():
+    adobj = AD(lambda a: (a * a).sum(), vectorize=True)
+    inp = np.array([[1., 2.], [3., 4.]])
+    assert adobj.grad(inp).tolist() == [[2, 4, 6, 8]]
+    adobj.set_mode('reverse')
+    assert adobj.grad(inp).tolist() == [[2, 4, 6, 8]]
+
+def test_vectorize_unused_input():
+    adobj = AD(lambda a, b: a.sum(), vectorize=True)
+    adobj.set_mode('reverse')
+    assert adobj.grad(np.ones(2), np.ones(3)).tolist() == [[1, 1, 0, 0, 0]]
+
+# Record once, replay many
+def test_replay_no_reevaluation():
+    calls = []
+    def f(x, y):
+        calls.append(1)
+        return [x * sin(y), x + y]
+    adobj = AD(f, replay=True)
+    adobj.grad(1.0, 2.0)
+    for x, y in [(3.0, 0.5), (-1.0, 4.0)]:
+        grad = adobj.grad(x, y)
+        assert np.allclose(grad, [[np.sin(y), x * np.cos(y)], [1, 1]])
+    assert len(calls) == 1
+
+def test_replay_branch_retrace():
+    calls = []
+    def f(x, y):
+        calls.append(1)
+        if x < y:
+            return x * y
+        return x + y
+    adobj = AD(f, replay=True)
+    assert (adobj.grad(1.0, 2.0) == [[2, 1]]).all()
+    assert (adobj.grad(0.0, 3.0) == [[3, 0]]).all()
+    assert len(calls) == 1
+    # x > y now: comparison flips, f must be recorded again
+    assert (adobj.grad(5.0, 3.0) == [[1, 1]]).all()
+    assert len(calls) == 2
+
+def test_replay_structure_retrace():
+    calls = []
+    def f(a):
+        calls.append(1)
+        return a.sum()
+    adobj = AD(f, replay=True)
+    adobj.grad(np.array([1., 2.]))
+    adobj.grad(np.array([3., 4.]))
+    assert len(calls) == 1
+    assert (adobj.grad(np.array([1., 2., 3.])) == [[1, 1, 1]]).all()
+    assert len(calls) == 2
+
+def test_replay_vectorize():
+    adobj = AD(lambda a: (a * a).sum(), vectorize=True, replay=True)
+    adobj.grad(np.array([1., 2.]))
+    assert (adobj.grad(np.array([3., 5.])) == [[6, 10]]).all()
+
+def test_compare_mixed_types():
+    assert Node(2, 0) < Node(3.0, 0)
+
+def test_compile():
+    def f(x, y):
+        return [x * y if x > y else x + y, sin(x)]
+    adobj = AD(f, compile=True)
+    assert np.allclose(adobj.grad(2.0, 1.0), [[1, 2], [np.cos(2), 0]])
+    # Compiled on the first call, used on the second
+    assert adobj._compiled
+    assert np.allclose(adobj.grad(3.0, 0.5), [[0.5, 3], [np.cos(3), 0]])
+    # Different branch: recorded and compiled again
+    assert np.allclose(adobj.grad(0.5, 3.0), [[1, 1], [np.cos(0.5), 0]])
+    assert np.allclose(adobj.grad(np.array([1.0, 2.0])[0], 4.0), [[1, 1], [np.cos(1), 0]])
+
+def test_compile_fallback():
+    adobj = AD(lambda x: abs(x) * 2, compile=True)
+    assert np.allclose(adobj.grad(-1.0), [[-2]])
+    assert np.allclose(adobj.grad(3.0), [[2]])
+    assert list(adobj._compiled.values()) == [None]
+
+def test_grad_batch():
+    f = lambda x, y: [x * y + sin(x), exp(y) / x, 2]
+    X, Y = np.linspace(0.5, 2, 5), np.linspace(-1, 1, 5)
+    jacobians = AD(f).grad_batch(X, Y)
+    assert jacobians.shape == (5, 3, 2)
+    for k in range(5):
+        assert np.allclose(jacobians[k], AD(f).grad(X[k], Y[k]))
+
+def test_grad_batch_array_argument():
+    f = lambda x: [x[0] * x[1], x[1] ** 2]
+    X = np.array([[1., 2.], [3., 4.], [-1., 0.5]])
+    jacobians = AD(f).grad_batch(X)
+    assert jacobians.shape == (3, 2, 2)
+    for k in range(3):
+        assert np.allclose(jacobians[k], AD(f).grad(X[k]))
+
+def test_grad_batch_invalid():
+    with pytest.raises(ValueError):
+        AD(lambda x, y: x * y).grad_batch(np.ones(3), np.ones(4))
+    with pytest.raises(ValueError):
+        AD(lambda x: x).grad_batch(np.ones((2, 2, 2)))
+    with pytest.raises(TypeError):
+        AD(lambda x: x).grad_batch(['a', 'b'])
+    with pytest.raises(ValueError):
+        AD(lambda x: x, vectorize=True).grad_batch(np.ones(3))
+
+def test_chunked_forward():
+    f = lambda x: [x[0] * x[1] + sin(x[4]), x[2] ** 2 - x[3] * x[0], 3]
+    x = np.array([1., 2., 3., 4., 5.])
+    expected = AD(f).grad(x)
+    for chunk_size in (1, 2, 3, 5, 10):
+        adobj = AD(f, chunk_size=chunk_size)
+        assert np.allclose(adobj.grad(x), expected)
+        assert adobj.seed is None
+
+def test_chunked_forward_vectorize():
+    f = lambda a, b: [(a * b).sum(), a[1] * 2]
+    a, b = np.array([1., 2., 3.]), np.array([4., 5., 6.])
+    assert np.allclose(AD(f, vectorize=True, chunk_size=2).grad(a, b), AD(f).grad(a, b))
+
+def test_chunked_forward_node_width():
+    adobj = AD(lambda x: x.sum(), vectorize=True, chunk_size=4)
+    adobj.grad(np.arange(10.))
+    assert np.shape(adobj.input_nodes[0].d) == (2, 10)
+    with pytest.raises(ValueError):
+        AD(lambda x: x, chunk_size=0)
+
+def test_auto_mode():
+    adobj = AD(lambda x: (x * x).sum(), vectorize=True)
+    adobj.set_mode('auto')
+    x = np.arange(5.)
+    assert np.allclose(adobj.grad(x), [2 * x])
+    assert list(adobj._modes.values()) == ['reverse']
+
+    adobj = AD(lambda x: [x * 2, x * 3, sin(x)])
+    adobj.set_mode('auto')
+    assert np.allclose(adobj.grad(1.0), [[2], [3], [np.cos(1)]])
+    assert list(adobj._modes.values()) == ['forward']
+
+def test_auto_mode_cached_per_structure():
+    adobj = AD(lambda *x: [sum(x)], chunk_size=2)
+    adobj.set_mode('auto')
+    adobj.grad(1., 2.)
+    adobj.grad(3., 4.)
+    adobj.grad(1.)
+    assert len(adobj._modes) == 2
+    assert sorted(adobj._modes.values()) == ['forward', 'reverse']
+
+def test_grad_sparse_forward():
+    pytest.importorskip('scipy')
+    # Each output depends on neighbouring inputs only: 3 seed columns instead of 8
+    f = lambda *x: [x[i - 1] * x[i] + sin(x[i]) for i in range(1, len(x))]
+    x = np.linspace(0.5, 2, 8)
+    adobj = AD(f)
+    jacobian = adobj.grad_sparse(*x)
+    assert jacobian.shape == (7, 8)
+    assert jacobian.nnz == 14
+    assert np.allclose(jacobian.toarray(), AD(f).grad(*x))
+    assert adobj.seed is None
+
+def test_grad_sparse_reverse():
+    pytest.importorskip('scipy')
+    # Every output depends on all inputs through its own input: rows need fewer colors
+    f = lambda a, b, c, d: [a * (b + c + d), b * 2, c ** 2]
+    jacobian = AD(f).grad_sparse(1., 2., 3., 4.)
+    assert np.allclose(jacobian.toarray(), AD(f).grad(1., 2., 3., 4.))
+
+def test_jvp():
+    f = lambda x, y: [x * y + sin(x), exp(y) / x, 3]
+    v = np.array([0.5, -2.])
+    assert np.allclose(AD(f).jvp((1.5, 0.5), v), AD(f).grad(1.5, 0.5) @ v)
+    adobj = AD(lambda a, b: [(a * b).sum(), a * 2], vectorize=True)
+    a, b = np.array([1., 2.]), np.array([3., 4.])
+    v = np.array([1., 0., -1., 2.])
+    assert np.allclose(adobj.jvp((a, b), v), adobj.grad(a, b) @ v)
+    assert adobj.seed is None
+    with pytest.raises(ValueError):
+        AD(f).jvp((1., 2.), [1.])
+
+def test_vjp():
+    f = lambda x, y: [x * y + sin(x), exp(y) / x, 3]
+    u = np.array([1., -1., 2.])
+    assert np.allclose(AD(f).vjp((1.5, 0.5), u), u @ AD(f).grad(1.5, 0.5))
+    adobj = AD(lambda a, b: [(a * b).sum(), a * 2], vectorize=True)
+    a, b = np.array([1., 2.]), np.array([3., 4.])
+    u = np.array([2., 1., -1.])
+    assert np.allclose(adobj.vjp((a, b), u), u @ adobj.grad(a, b))
+    with pytest.raises(ValueError):
+        AD(f).vjp((1., 2.), [1.])
+
+def numeric_hessian(f, x, h=1e-6):
+    '''Central differences of the reverse mode gradient'''
+    def gradient(x):
+        adobj = AD(f)
+        adobj.set_mode('reverse')
+        return adobj.grad(*x)[0]
+    columns = []
+    for k in range(len(x)):
+        e = np.zeros(len(x))
+        e[k] = h
+        columns.append((gradient(x + e) - gradient(x - e)) / (2 * h))
+    return np.array(columns).T
+
+def test_hessian():
+    f = lambda x, y, z: x * y * z + sin(x) * exp(y) - z ** 3 / y + exp(x * z, 2)
+    x = np.array([1.3, 0.7, 2.2])
+    hessian = AD(f).hessian(*x)
+    assert np.allclose(hessian, hessian.T)
+    assert np.allclose(hessian, numeric_hessian(f, x), atol=1e-6)
+
+def test_hessian_exact():
+    assert np.array_equal(AD(lambda x, y: x * x * y).hessian(1., 2.), [[4, 2], [2, 0]])
+    assert np.array_equal(AD(lambda x, y: x + 2 * y).hessian(1., 2.), np.zeros((2, 2)))
+    assert np.allclose(AD(lambda x: sin(x)).hessian(1.), [[-np.sin(1)]])
+
+def test_hessian_sparse():
+    # Each input only interacts with its neighbours
+    f = lambda *x: sum(sin(x[i] * x[i + 1]) for i in range(len(x) - 1))
+    x = np.linspace(0.1, 1, 6)
+    assert np.allclose(AD(f).hessian(*x), numeric_hessian(f, x), atol=1e-6)
+
+def test_hvp():
+    f = lambda x, y, z: x ** y + tanh(x * z) - abs(y) * z / x
+    x, v = np.array([1.3, 0.7, 2.2]), np.array([1., -2., 0.5])
+    assert np.allclose(AD(f).hvp(tuple(x), v), numeric_hessian(f, x) @ v, atol=1e-6)
+    with pytest.raises(ValueError):
+        AD(f).hvp(tuple(x), [1., 2.])
+    with pytest.raises(ValueError):
+        AD(lambda x: [x, x * x]).hessian(1.)
+    with pytest.raises(ValueError):
+        AD(lambda x: x.sum(), vectorize=True).hessian(np.ones(2))
+
+def test_node_numpy_functions():
+    # numpy calls the methods of the same name on (nested) Nodes
+    x = Node(Node(0.5, 1.), 0, check=False)
+    assert np.sin(x).v.v == np.sin(0.5)
+    assert np.exp(x).v.d == np.exp(0.5)
+    assert Node(Node(2., 1.), 0, check=False) > 1
+
+def test_taylor():
+    # Derivatives of exp(2t), sin(t) * t, 1 / (1 + t) at t = 0
+    f = lambda x: [exp(x * 2), sin(x) * x, 1 / (1 + x)]
+    derivatives = AD(f).taylor((0.,), [1.], 4)
+    assert derivatives.shape == (3, 5)
+    assert np.allclose(derivatives[0], [1, 2, 4, 8, 16])
+    assert np.allclose(derivatives[1], [0, 0, 2, 0, -4])
+    assert np.allclose(derivatives[2], [1, -1, 2, -6, 24])
+
+def test_taylor_matches_second_order():
+    f = lambda x, y: x ** y + tan(x) * tanh(y) - abs(x - y) * sqrt(x) / y + exp(x, 2) * cos(y)
+    x, v = (0.7, 0.4), np.array([0.3, -1.2])
+    derivatives = AD(f).taylor(x, v, 2)[0]
+    adobj = AD(f)
+    adobj.set_mode('reverse')
+    assert np.isclose(derivatives[1], adobj.grad(*x)[0] @ v)
+    assert np.isclose(derivatives[2], v @ AD(f).hessian(*x) @ v)
+
+def test_taylor_invalid():
+    with pytest.raises(ValueError):
+        AD(lambda x, y: x * y).taylor((1., 2.), [1.], 3)
+    with pytest.raises(ValueError):
+        AD(lambda x: x.sum(), vectorize=True).taylor((np.ones(2),), [1., 1.], 2)
+
+# Module level, so that worker processes can unpickle it
+def wide_function(x):
+    return [x[i] * x[i + 1] + sin(x[i]) for i in range(len(x) - 1)]
 
+def test_processes():
+    x = np.linspace(0.1, 2, 9)
+    expected = AD(wide_function).grad(x)
+    adobj = AD(wide_function, processes=2)
+    assert np.allclose(adobj.grad(x), expected)
+    adobj.set_mode('reverse')
+    assert np.allclose(adobj.grad(x), expected)
+    assert np.allclose(AD(wide_function, processes=3, chunk_size=2).grad(x), expected)
+    with pytest.raises(ValueError):
+        AD(wide_function, processes=0)
+
+def test_threads_share_ad():
+    from concurrent.futures import ThreadPoolExecutor
+    def f(x, y):
+        return [x * y + sin(x) if x > y else x - y * y, exp(y) / x]
+    expected = lambda x, y: AD(f).grad(x, y)
+    points = [(1.5 + k * 0.01, 1.005 + (k % 7) * 0.2) for k in range(200)]
+
+    for options in ({}, {'replay': True}, {'compile': True}, {'chunk_size': 1}):
+        for mode in ('forward', 'reverse', 'auto'):
+            adobj = AD(f, **options)
+            adobj.set_mode(mode)
+            def call(point):
+                grad = adobj.grad(*point)
+                # Per call state belongs to this thread's call
+                assert adobj.n == 2 and adobj.m == 2
+                return grad
+            with ThreadPoolExecutor(8) as pool:
+                results = list(pool.map(call, points))
+            for point, result in zip(points, results):
+                assert np.allclose(result, expected(*point))
+
+def test_threads_seed():
+    from concurrent.futures import ThreadPoolExecutor
+    adobj = AD(lambda x, y: [x * y])
+    adobj.set_seed([[1, 0], [0, 2]])
+    # jvp temporarily replaces the seed in its own thread only
+    def call(k):
+        if k % 2:
+            return adobj.jvp((1., 3.), [1., 1.])
+        return adobj.grad(1., 3.)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(call, range(100)))
+    for k, result in enumerate(results):
+        assert np.allclose(result, [4] if k % 2 else [[3, 2]])
+    assert np.array_equal(adobj.seed, [[1, 0], [0, 2]])
+
+def test_reverse_frees_graph():
+    f = lambda x, y: [sin(x * y) + x, x * y]
+    adobj = AD(f)
+    adobj.set_mode('reverse')
+    assert np.allclose(adobj.grad(1., 2.), [[2 * np.cos(2) + 1, np.cos(2)], [2, 1]])
+    assert adobj.input_nodes is None and adobj.output_nodes is None and adobj.tape is None
+
+def test_reverse_retain_graph():
+    adobj = AD(lambda x, y: [sin(x * y) + x], retain_graph=True)
+    adobj.set_mode('reverse')
+    grad = adobj.grad(1., 2.)
+    assert adobj.tape is not None
+    assert np.allclose([n.back_g[0] for n in adobj.input_nodes], grad[0])
+
+def test_nary_functions_grad():
+    f = lambda x: [nsum(x), prod(x), logsumexp(x), dot(x[:2], x[2:])] + list(matmul(np.array(x).reshape(2, 2), x[:2]))
+    g = lambda x: [x[0] + x[1] + x[2] + x[3], x[0] * x[1] * x[2] * x[3],
+                   log(exp(x[0]) + exp(x[1]) + exp(x[2]) + exp(x[3])), x[0] * x[2] + x[1] * x[3],
+                   x[0] * x[0] + x[1] * x[1], x[2] * x[0] + x[3] * x[1]]
+    x = np.array([0.5, 0., 2., -1.])
+    adobj = AD(f)
+    adobj.set_mode('reverse')
+    assert np.allclose(adobj.grad(x), AD(g).grad(x))
+    assert np.allclose(AD(f).grad(x), AD(g).grad(x))
+
+def test_numpy_ufuncs():
+    x = Node(0.5, np.array([1., 0.]))
+    assert np.sin(x).v == np.sin(0.5) and np.array_equal(np.sin(x).d, [np.cos(0.5), 0])
+    assert np.add(2, x).v == 2.5 and np.exp2(x).v == 2 ** 0.5
+    assert np.less(x, 1) and not np.greater(x, 1)
+    assert np.shape(x) == ()
+    # np.arrays of scalar Nodes stay np.arrays of scalar Nodes
+    y = np.array([1., 2.]) * x
+    assert y.dtype == object and y.shape == (2,) and np.array_equal(y[1].d, [2, 0])
+    z = np.array([x, x]) * x
+    assert z.dtype == object and z.shape == (2,) and z[0].v == 0.25
+
+def test_numpy_functions_vectorize():
+    W = np.arange(6.).reshape(2, 3)
+    x = np.array([1., 2., 3.])
+    f = lambda v: [np.sum(np.sin(v) * v), np.prod(v), np.mean(np.dot(W, v)), np.matmul(v, v)]
+    g = lambda v: [v[0] * sin(v[0]) + v[1] * sin(v[1]) + v[2] * sin(v[2]), v[0] * v[1] * v[2],
+                   (3 * v[0] + 5 * v[1] + 7 * v[2]) / 2, v[0] * v[0] + v[1] * v[1] + v[2] * v[2]]
+    adobj = AD(f, vectorize=True)
+    assert np.allclose(adobj.grad(x), AD(g).grad(x))
+    adobj.set_mode('reverse')
+    assert np.allclose(adobj.grad(x), AD(g).grad(x))
+
+def test_numpy_arrays_of_nodes():
+    # With a Node holding an array, the np.array of Nodes is a single operand of a single
+    # matrix product
+    f = lambda a: np.dot(np.array([a[0], a[1] * 2]), a)
+    adobj = AD(f, vectorize=True)
+    assert np.allclose(adobj.grad(np.array([2., 3.])), [[4, 12]])
+    adobj.set_mode('reverse')
+    assert np.allclose(adobj.grad(np.array([2., 3.])), [[4, 12]])
+    tape = adobj._record(np.array([2., 3.]))
+    assert np.sum(tape.op == tape.functions.index(_matmul)) == 1
+
+def test_numpy_arrays_of_scalar_nodes():
+    # Without vectorize the tape keeps scalar Nodes, as needed by second order derivatives
+    # and sparsity detection
+    x = np.array([1., 2., 3.])
+    assert np.allclose(AD(lambda x: nsum(x * x[0])).hessian(x), [[2, 1, 1], [1, 0, 0], [1, 0, 0]])
+    jacobian = AD(lambda x: x * x[0]).grad_sparse(x)
+    if not isinstance(jacobian, tuple):
+        jacobian = jacobian.toarray()
+    else:
+        data, (rows, cols) = jacobian
+        jacobian = np.zeros((3, 3))
+        jacobian[rows, cols] = data
+    assert np.allclose(jacobian, [[2, 0, 0], [2, 1, 0], [3, 0, 1]])
+
+def test_grad_cache():
+    calls = []
+    def f(x, y):
+        calls.append(1)
+        return [x * y, sin(x)]
+    adobj = AD(f, cache_size=2)
+    first = adobj.grad(1., 2.)
+    first[0, 0] = 100
+    assert np.allclose(adobj.grad(1., 2.), [[2, 1], [np.cos(1), 0]]) and len(calls) == 1
+    assert adobj.m == 2 and adobj.n == 2
+    # Mode and seed are part of the key
+    adobj.set_mode('reverse')
+    adobj.grad(1., 2.)
+    assert len(calls) == 2
+    adobj.set_mode('forward')
+    adobj.set_seed([[2, 0], [0, 1]])
+    assert np.allclose(adobj.grad(1., 2.), [[4, 1], [2 * np.cos(1), 0]]) and len(calls) == 3
+    info = adobj.cache.info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (1, 3, 1, 2)
+
+def test_grad_no_cache():
+    assert AD(lambda x: x).cache is None
+
+def test_replay_after_other_recordings():
+    adobj = AD(lambda *x: nsum(x) * x[0], replay=True)
+    assert np.allclose(adobj.grad(1., 2.), [[4, 1]])
+    # hessian and vjp record other tapes, which replay must not pick up
+    adobj.hessian(1., 2., 3.)
+    assert np.allclose(adobj.grad(1., 2.), [[4, 1]])
+    adobj.vjp((1., 2., 3.), [1.])
+    assert np.allclose(adobj.grad(1., 2.), [[4, 1]])
+
+def test_nary_functions_arrays():
+    # Elements holding arrays are combined elementwise, not summed over the batch
+    X = np.array([[1., 2.], [3., 4.]])
+    assert np.allclose(AD(lambda x: nsum(x) ** 2).grad_batch(X), [[[6, 6]], [[14, 14]]])
+    f = lambda x: [nsum(x) * x[0], prod(x) * x[0], logsumexp(x), dot(x, x), nsum([x[0], 2., x[1]]) / x[1]]
+    g = lambda x: [(x[0] + x[1]) * x[0], x[0] * x[1] * x[0], log(exp(x[0]) + exp(x[1])),
+                   x[0] * x[0] + x[1] * x[1], (x[0] + 2. + x[1]) / x[1]]
+    assert np.allclose(AD(f).grad_batch(X), AD(g).grad_batch(X))
+    for mode in ('forward', 'reverse'):
+        adobj = AD(lambda v, w: f([v, w]), vectorize=True)
+        adobj.set_mode(mode)
+        expected = AD(lambda v, w: g([v, w]), vectorize=True)
+        expected.set_mode(mode)
+        assert np.allclose(adobj.grad(X[:, 0], X[:, 1]), expected.grad(X[:, 0], X[:, 1]))
+
+def test_hessian_at_origin():
+    f = lambda x, y: x ** 2 + y ** 2
+    assert np.allclose(AD(f).hessian(0., 1.), [[2, 0], [0, 2]])
+    assert np.allclose(AD(f).taylor((0., 1.), [1., 1.], 2), [[1, 2, 4]])
+    assert np.allclose(AD(lambda x: x ** 3).hessian(0.), [[0]])
+
+def test_power_input_exponent_negative_base():
+    # The exponent is an input: its derivative x**y * log(x) is nan, never silently 0
+    f = lambda x, y: x ** y
+    for options in ({}, {'replay': True}, {'incremental': True}):
+        adobj = AD(f, **options)
+        adobj.set_mode('reverse')
+        with np.errstate(invalid='ignore'):
+            grad = adobj.grad(-2., 2.)
+        assert grad[0, 0] == -4 and np.isnan(grad[0, 1])
+    # A constant exponent skips the log term
+    adobj = AD(lambda x: x ** 2)
+    adobj.set_mode('reverse')
+    assert np.allclose(adobj.grad(-2.), [[-4]])
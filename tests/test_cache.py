@@ -0,0 +1,33 @@
+import pytest
+import numpy as np
+from funkyAD.cache import LRUCache, array_key
+from funkyAD.base import Node
+
+
+def test_lru_eviction():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None and cache.get('c') == 3
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.maxsize, info.currsize) == (2, 1, 1, 2, 2)
+    cache.clear()
+    assert len(cache) == 0 and cache.info().hits == 0
+
+def test_lru_size():
+    with pytest.raises(ValueError):
+        LRUCache(0)
+
+def test_array_key():
+    x = np.array([1., 2.])
+    assert array_key(x, 3.) == array_key(x.copy(), 3.)
+    assert array_key(x) != array_key(np.array([1., 2.5]))
+    # Same bytes, different shape, dtype or type
+    assert array_key(x) != array_key(x.reshape(2, 1))
+    assert array_key(np.array([1, 2])) != array_key(np.array([1., 2.]))
+    assert array_key([1., 2.]) != array_key(x)
+    assert array_key(None) == (None,)
+    assert array_key([Node(1.)]) is None
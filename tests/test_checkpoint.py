@@ -0,0 +1,70 @@
+import pytest
+import numpy as np
+from funkyAD.base import AD, Node
+from funkyAD.functions import sin, exp
+from funkyAD.checkpoint import checkpoint, _flatten, _Segment
+
+
+def block(state):
+    x, v = state
+    for _ in range(10):
+        x, v = x + 0.1 * v, v - 0.1 * sin(x)
+    return [x, v]
+
+def simulate(step):
+    def f(x, v):
+        state = [x, v]
+        for _ in range(5):
+            state = step(state)
+        return [state[0] * state[1], exp(state[0])]
+    return f
+
+def reverse_grad(f, *args, **options):
+    adobj = AD(f, **options)
+    adobj.set_mode('reverse')
+    return adobj.grad(*args)
+
+def test_checkpoint_gradient():
+    expected = reverse_grad(simulate(block), 0.5, 0.2)
+    assert np.allclose(reverse_grad(simulate(checkpoint(block)), 0.5, 0.2), expected)
+    assert np.allclose(reverse_grad(simulate(AD.checkpoint(block)), 0.5, 0.2, replay=True), expected)
+
+def test_checkpoint_keeps_boundaries_only():
+    plain = AD(simulate(block))
+    plain._record(0.5, 0.2)
+    checkpointed = AD(simulate(checkpoint(block)))
+    checkpointed._record(0.5, 0.2)
+    # Two recorded outputs per block instead of every operation of the 10 steps
+    assert len(checkpointed.tape) < len(plain.tape) / 10
+
+def test_checkpoint_recording_dropped(monkeypatch):
+    segments = []
+    init = _Segment.__init__
+    def tracked(self, *args):
+        init(self, *args)
+        segments.append(self)
+    monkeypatch.setattr(_Segment, '__init__', tracked)
+    reverse_grad(simulate(checkpoint(block)), 0.5, 0.2)
+    # Each block was recorded again during the sweep, then dropped
+    assert len(segments) == 5
+    assert all(segment.tape is None and segment.pending == 0 for segment in segments)
+
+def test_checkpoint_forward_mode():
+    f = simulate(checkpoint(block))
+    assert np.allclose(AD(f).grad(0.5, 0.2), reverse_grad(simulate(block), 0.5, 0.2), atol=1e-6)
+
+def test_checkpoint_single_output_and_constants():
+    square = checkpoint(lambda x, c: x * x * c)
+    f = lambda x, y: square(x, 3.) + square(y, 2)
+    assert np.allclose(reverse_grad(f, 1., 2.), [[6, 8]])
+
+def test_checkpoint_array_argument():
+    double = checkpoint(lambda a: np.array([a[0] * a[1], sin(a[1])]))
+    f = lambda x: list(double(x))
+    assert np.allclose(reverse_grad(f, np.array([2., 3.])), [[3, 2], [0, np.cos(3)]])
+
+def test_flatten():
+    leaves, rebuild = _flatten([1, [2, 3], np.array([4])])
+    assert leaves == [1, 2, 3, 4]
+    out = rebuild([5, 6, 7, 8])
+    assert out[0] == 5 and out[1] == [6, 7] and isinstance(out[2], np.ndarray)
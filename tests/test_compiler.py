@@ -0,0 +1,45 @@
+import pytest
+import numpy as np
+from funkyAD.base import AD
+from funkyAD.functions import sin, exp, log, _abs, sigmoid, tanh
+from funkyAD.tape import record
+from funkyAD.compiler import compile_tape, Retrace
+
+
+def test_compile_tape():
+    tape = record(lambda x, y: [x * y + sin(x), exp(y) / x], 1.0, 2.0)
+    compiled = compile_tape(tape)
+    assert 'Node' not in compiled.source
+    values, jacobian = compiled([0.5, 3.0])
+    assert np.allclose(values, [1.5 + np.sin(0.5), np.exp(3) / 0.5])
+    assert np.allclose(jacobian, [[3 + np.cos(0.5), 0.5],
+                                  [-np.exp(3) / 0.25, np.exp(3) / 0.5]])
+
+def test_compile_matches_reverse():
+    f = lambda x, y, z: [x ** 2 * y - z / y + tanh(x * z), sigmoid(-y) + log(z) - (x - 1) ** 3]
+    compiled = compile_tape(record(f, 1.5, 2.0, 3.0))
+    for point in ([0.3, -1.2, 2.5], [2.0, 0.7, 0.1]):
+        adobj = AD(f)
+        adobj.set_mode('reverse')
+        assert np.allclose(compiled(point)[1], adobj.grad(*point))
+
+def test_compile_unused_input():
+    compiled = compile_tape(record(lambda x, y: [x * 2], 1.0, 2.0))
+    assert np.allclose(compiled([3.0, 4.0])[1], [[2, 0]])
+
+def test_compile_not_supported():
+    # abs checks for a non-differentiable point at runtime
+    assert compile_tape(record(lambda x: [_abs(x)], 1.0)) is None
+    # x ** y needs log(x), which has no template
+    assert compile_tape(record(lambda x, y: [x ** y], 1.0, 2.0)) is None
+    assert compile_tape(record(lambda x: [x ** 2], 1.0)) is not None
+
+def test_compile_guards():
+    def f(x, y):
+        return [x * 2 if x > y else x * 3]
+    compiled = compile_tape(record(f, 2.0, 1.0))
+    assert np.allclose(compiled([5.0, 1.0])[1], [[2, 0]])
+    with pytest.raises(Retrace):
+        compiled([0.0, 1.0])
+    with pytest.raises(Retrace):
+        compiled([1.0, 1.0])
@@ -1,7 +1,10 @@
 import pytest
 import numpy as np
 from funkyAD.base import Node
-from funkyAD.functions import BaseFunction, invalid_op, addition, multiplication, division, floordiv, power, sqrt, sign, r_der, pos, neg, _abs, invert, _round, floor, ceil, trunc, base_check, exp, log, sin, cos, tan, sinh, cosh, tanh, arcsin, arccos, arctan, one_check, logistic, sigmoid
+from funkyAD.functions import BaseFunction, index, _sum, invalid_op, addition, multiplication, division, floordiv, power, sqrt, sign, r_der, pos, neg, _abs, invert, _round, floor, ceil, trunc, base_check, exp, log, sin, cos, tan, sinh, cosh, tanh, arcsin, arccos, arctan, one_check, logistic, sigmoid
+from funkyAD.functions import nsum, prod, mean, logsumexp, dot, matmul, nary_sum, stack_derivatives
+from funkyAD.functions import stack, _prod, _matmul
+from funkyAD.functions import series_mul, series_div, series_exp, series_log, series_power, series_sincos
 
 # BaseFunction
 def test_define_basefunction():
@@ -282,3 +285,159 @@ def test_logistic():
 def test_sigmoid():
     assert sigmoid(Node(2, 3)) == Node(1/(1+np.exp(-2)), 3*np.exp(2)/(1+np.exp(2))**2)
     assert sigmoid(2) == Node(1/(1+np.exp(-2)), 0)
+
+# Adjoint rules must agree with the forward derivative of each argument
+def test_adjoints_match_derivative():
+    unary = [sqrt, pos, neg, _abs, exp, log, sin, cos, tan, sinh, cosh, tanh,
+             arcsin, arccos, arctan, sigmoid]
+    for f in unary:
+        assert f.adjoint is not None
+        g = np.array([1.0, 2.0])
+        x = Node(0.3, 0)
+        contribution, = f.adjoint(g, x)
+        assert np.allclose(contribution, g * f.d(Node(0.3, 1)))
+
+def test_adjoints_binary():
+    g = np.array([1.0, -1.0])
+    for f in [addition, multiplication, division, power]:
+        cx, cy = f.adjoint(g, Node(1.5), Node(2.5))
+        assert np.allclose(cx, g * f.d(Node(1.5, 1), Node(2.5, 0)))
+        assert np.allclose(cy, g * f.d(Node(1.5, 0), Node(2.5, 1)))
+
+def test_adjoints_constant_parameters():
+    cx, cb = exp.adjoint(2.0, Node(2), Node(3))
+    assert np.isclose(cx, 2 * np.log(3) * 3 ** 2) and cb == 0
+    cx, cb = log.adjoint(1.0, Node(8), 2)
+    assert np.isclose(cx, 1 / (8 * np.log(2))) and cb == 0
+    assert logistic.adjoint(1.0, Node(2), Node(10), Node(100))[1:] == (0, 0)
+    assert _round.adjoint(1.0, Node(2.56), Node(1)) == (0, 0)
+
+def test_adjoint_rounding_undefined():
+    with pytest.raises(ValueError):
+        floor.adjoint(1.0, Node(2))
+    with pytest.raises(ValueError):
+        invert.adjoint(1.0, Node(2))
+
+def test_basefunction_no_adjoint():
+    new_func = BaseFunction(lambda x, y: x.v * y.v, lambda x, y: x.d * y.v + x.v * y.d)
+    assert new_func.adjoint is None
+
+# Array valued Nodes
+def test_elementwise_array_node():
+    x = Node(np.array([0.5, 1.0]), np.array([[1., 0.], [0., 1.]]))
+    y = sin(x)
+    assert np.allclose(y.v, np.sin([0.5, 1.0]))
+    assert np.allclose(y.d, np.diag(np.cos([0.5, 1.0])))
+
+def test_scalar_times_array_node():
+    # Derivatives are aligned so that a scalar Node's seed axis broadcasts correctly
+    x = Node(2.0, np.array([1., 0., 0.]))
+    a = Node(np.array([1., 3.]), np.array([[0., 0.], [1., 0.], [0., 1.]]))
+    y = x * a
+    assert np.allclose(y.v, [2, 6])
+    assert np.allclose(y.d, [[1, 3], [2, 0], [0, 2]])
+
+def test_sign_array():
+    assert (sign(np.array([-2, 3])) == [-1, 1]).all()
+    with pytest.raises(ValueError):
+        sign(np.array([-2, 0]))
+
+def test_r_der_array():
+    assert (r_der(np.array([1.5, 2.5])) == 0).all()
+    with pytest.raises(ValueError):
+        r_der(np.array([1.5, 2.0]))
+
+def test_abs_array():
+    x = _abs(Node(np.array([-1., 2.]), np.array([1., 1.])))
+    assert (x.v == [1, 2]).all() and (x.d == [-1, 1]).all()
+
+def test_index():
+    x = Node(np.array([1., 2., 3.]), np.eye(3))
+    y = index(x, 1)
+    assert y.v == 2 and (y.d == [0, 1, 0]).all()
+    assert (index(x, slice(0, 2)).d == [[1, 0], [0, 1], [0, 0]]).all()
+
+def test_index_adjoint():
+    x = Node(np.array([1., 2., 3.]))
+    back, = x[[0, 0, 2]].f.adjoint(np.array([[1., 2., 3.]]), x)
+    assert (back == [[3, 0, 3]]).all()
+
+def test_sum_array_node():
+    x = Node(np.array([1., 2., 3.]), np.eye(3))
+    y = _sum(x)
+    assert y.v == 6 and (y.d == [1, 1, 1]).all()
+    back, = _sum.adjoint(np.array([1., 2.]), x)
+    assert (back == [[1, 1, 1], [2, 2, 2]]).all()
+
+def test_taylor_rules():
+    # Series of t -> 0.5 + t
+    a = np.array([0.5, 1., 0., 0., 0.])
+    assert np.allclose(series_mul(a, a), [0.25, 1, 1, 0, 0])
+    assert np.allclose(series_div(series_mul(a, a), a), a)
+    assert np.allclose(series_log(series_exp(a)), a)
+    assert np.allclose(series_power(a, 3), series_mul(a, series_mul(a, a)))
+    assert np.allclose(series_power(series_power(a, 0.5), 2), a)
+    s, c = series_sincos(a)
+    assert np.allclose(series_mul(s, s) + series_mul(c, c), [1, 0, 0, 0, 0])
+
+def test_nary_single_node():
+    xs = [Node(1., [1, 0, 0]), Node(2., [0, 1, 0]), 3.]
+    y = nsum(xs)
+    assert y.f is nary_sum and len(y.parents) == 3
+    assert y.v == 6 and np.array_equal(y.d, [1, 1, 0])
+
+def test_stack_derivatives():
+    d = stack_derivatives([Node(1., [1, 2]), Node(2., 0)])
+    assert np.array_equal(d, [[1, 2], [0, 0]])
+
+def test_nary_values_and_derivatives():
+    a, b, c = Node(2., [1, 0, 0]), Node(0., [0, 1, 0]), Node(-1., [0, 0, 1])
+    assert prod([a, b, c]).v == 0 and np.array_equal(prod([a, b, c]).d, [0, -2, 0])
+    assert mean([a, b, c]).v == 1 / 3 and np.allclose(mean([a, b, c]).d, [1 / 3] * 3)
+    weights = np.exp([2., 0., -1.]) / np.sum(np.exp([2., 0., -1.]))
+    assert np.isclose(logsumexp([a, b, c]).v, np.log(np.sum(np.exp([2., 0., -1.]))))
+    assert np.allclose(logsumexp([a, b, c]).d, weights)
+    assert dot([a, b], [c, 3.]).v == -2 and np.array_equal(dot([a, b], [c, 3.]).d, [-1, 3, 2])
+
+def test_logsumexp_large():
+    assert np.isclose(logsumexp([Node(1000., 1), Node(1000., 0)]).v, 1000 + np.log(2))
+
+def test_nary_adjoints():
+    a, b = Node(2.), Node(3.)
+    g = np.array([1., 2.])
+    assert np.array_equal(nary_sum.adjoint(g, a, b)[1], g)
+    assert np.array_equal(prod([a, b]).f.adjoint(g, a, b)[0], 3 * g)
+    assert np.array_equal(dot([a], [b]).f.adjoint(g, a, b)[1], 2 * g)
+
+def test_matmul():
+    A = np.array([[Node(1., [1, 0]), Node(2., 0)], [Node(3., 0), Node(4., [0, 1])]])
+    C = matmul(A, np.array([[1., 0.], [0., 1.]]))
+    assert C.shape == (2, 2) and C[1, 0].v == 3 and np.array_equal(C[0, 0].d, [1, 0])
+    assert matmul(A, [1., 1.]).shape == (2,)
+    assert matmul([1., 1.], A).shape == (2,)
+    with pytest.raises(ValueError):
+        matmul(A, [1., 1., 1.])
+    with pytest.raises(ValueError):
+        dot([1.], [1., 2.])
+
+def test_stack():
+    x = stack(np.array([[Node(1., [1, 0]), 2.], [Node(3., [0, 1]), 4.]]))
+    assert np.array_equal(x.v, [[1, 2], [3, 4]])
+    assert np.array_equal(x.d, [[[1, 0], [0, 0]], [[0, 0], [1, 0]]])
+    g = np.arange(8.).reshape(2, 2, 2)
+    assert np.array_equal(x.f.adjoint(g, *x.parents)[2], [2, 6])
+
+def test_array_prod():
+    x = _prod(Node(np.array([2., 0., 3.]), np.eye(3)))
+    assert x.v == 0 and np.array_equal(x.d, [0, 6, 0])
+    assert np.array_equal(x.f.adjoint(np.array([1., 2.]), *x.parents)[0], [[0, 6, 0], [0, 12, 0]])
+
+def test_array_matmul():
+    A = np.arange(6.).reshape(2, 3)
+    b = Node(np.array([1., 2., 3.]), np.eye(3))
+    assert np.array_equal(_matmul(A, b).v, [8, 26])
+    assert np.array_equal(_matmul(A, b).d, A.T)
+    assert np.array_equal(_matmul(b, b).d, [2, 4, 6])
+    g = np.array([[1., 0.], [0., 1.]])
+    back = _matmul(A, b).f.adjoint(g, Node(A), b)
+    assert np.array_equal(back[1], A) and np.array_equal(back[0][1], [[0, 0, 0], [1, 2, 3]])
@@ -84,3 +84,35 @@ def test_recursive_append():
     recursive_append(x,trace)
     assert trace == [Node(1,1),Node(2,1)]
     
+
+def test_recursive_append_deep():
+    # Deeper than the default recursion limit
+    x = Node(0, 0)
+    for _ in range(5000):
+        parent, x = x, Node(0, 0)
+        x.parents = [parent]
+    trace = []
+    recursive_append(x, trace)
+    assert len(trace) == 5001
+
+def test_count_recursive_deep():
+    x = [1]
+    for _ in range(5000):
+        x = [x, 1]
+    assert count_recursive(x) == 5001
+
+def test_unpack_deep():
+    x = [1]
+    for _ in range(5000):
+        x = [x]
+    assert unpack(x) == [1]
+
+def test_unpack_order():
+    assert unpack([[1, [2, 3]], 4, [[5]]]) == [1, 2, 3, 4, 5]
+
+def test_nodify_validates():
+    with pytest.raises(TypeError):
+        nodify(['a', 2], [1, 0])
+
+def test_nodify_no_validate():
+    assert nodify([1, 2], [1, 0], validate=False) == [Node(1, 1), Node(2, 0)]
@@ -0,0 +1,73 @@
+import pytest
+import numpy as np
+from funkyAD.base import AD
+from funkyAD.functions import sin, exp, nsum
+from funkyAD.tape import record
+from funkyAD.incremental import IncrementalTape
+
+
+def f(x, y, z):
+    return [x * y + sin(z), exp(z) * z]
+
+def test_incremental_update():
+    state = IncrementalTape(record(f, 1., 2., 3.))
+    assert state.update([1., 2., 3.]) and state.recomputed == 0
+    # Only x * y and the sum depend on y
+    assert state.update([1., 4., 3.]) and state.recomputed == 2
+    expected = [[4, 1, np.cos(3)], [0, 0, np.exp(3) * 4]]
+    assert np.allclose(state.jacobian(), expected)
+
+def test_incremental_guards():
+    def g(x, y):
+        if x < y:
+            return [x * y]
+        return [x + y]
+    state = IncrementalTape(record(g, 1., 2.))
+    assert state.update([1., 3.])
+    assert not state.update([4., 3.])
+
+def test_incremental_arrays():
+    with pytest.raises(ValueError):
+        IncrementalTape(record(lambda x: [x * 2], np.ones(2)))
+
+def test_ad_incremental():
+    def h(*x):
+        terms = [sin(a) * a for a in x]
+        return [nsum(terms), x[0] * x[1] + (x[2] if x[0] < 1 else x[3])]
+    x = np.linspace(0.1, 2, 20)
+    adobj = AD(h, incremental=True)
+    expected = AD(h)
+    expected.set_mode('reverse')
+    assert np.allclose(adobj.grad(*x), expected.grad(*x))
+    for k, step in [(5, 0.3), (0, 1.), (0, 0.1)]:
+        x = x.copy()
+        x[k] += step
+        assert np.allclose(adobj.grad(*x), expected.grad(*x))
+        assert adobj.m == 2 and adobj.n == 20
+    # x[0] changed without changing the branch: sin(x0), its product, the sum, x0 * x1
+    # and the last addition
+    assert adobj._incremental.recomputed == 5
+    with pytest.raises(ValueError):
+        AD(lambda x: x.sum(), vectorize=True, incremental=True).grad(np.ones(2))
+
+def test_incremental_jacobian_sweep():
+    def h(*x):
+        return [nsum([sin(a) * a for a in x]), x[0] * x[1]]
+    x = list(np.linspace(0.1, 2, 50))
+    state = IncrementalTape(record(h, *x))
+    # Nothing changed: nothing is swept again
+    assert state.update(x)
+    state.jacobian()
+    assert state.swept == 0
+    x[10] += 0.5
+    assert state.update(x)
+    jacobian = state.jacobian()
+    # sin(x10) and x10: the partials of the sum do not change
+    assert state.swept == 2
+    expected = AD(h)
+    expected.set_mode('reverse')
+    assert np.allclose(jacobian, expected.grad(*x))
+    # Every back-gradient depends on a product of all the inputs
+    state = IncrementalTape(record(lambda *x: [nsum(x) * x[0] * x[1]], 1., 2., 3.))
+    assert state.update([1., 2., 4.])
+    assert np.allclose(state.jacobian(), [[16, 9, 2]])
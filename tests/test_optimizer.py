@@ -0,0 +1,64 @@
+import pytest
+import numpy as np
+from funkyAD.base import AD
+from funkyAD.functions import sin, exp
+from funkyAD.tape import CONST, record
+from funkyAD.optimizer import optimize_tape
+
+
+def f(x, y):
+    unused = exp(x) * 3
+    c = sin(2.) * 3
+    a = x * y + c
+    b = x * y + c
+    return [a * b, a + x * 2 + x * 2]
+
+def test_optimize_report():
+    tape, report = optimize_tape(record(f, 1., 2.))
+    # sin(2.) and sin(2.) * 3 are folded, a second x * y, + c, 2 and x * 2 merged, and
+    # exp(x), 3, its product and the constants of the folded operations dropped
+    assert report == {'folded': 2, 'merged': 6, 'pruned': 4}
+    assert len(tape) == 10
+    assert np.sum(tape.op == CONST) == 2
+
+def test_optimize_same_results():
+    tape = record(f, 1., 2.)
+    optimized, _ = optimize_tape(tape)
+    expected = tape.reverse([np.array([1., 0.]), np.array([0., 1.])])[tape.inputs]
+    assert np.allclose(optimized.reverse([np.array([1., 0.]), np.array([0., 1.])])[optimized.inputs], expected)
+    assert optimized.replay([3., 0.5])
+    assert tape.replay([3., 0.5])
+    assert np.allclose(optimized.values[optimized.outputs], tape.values[tape.outputs])
+
+def test_optimize_constants():
+    # 0.0 and -0.0 are different constants: only the second 0.0 and x * 0.0 are merged
+    tape, report = optimize_tape(record(lambda x: [x * 0.0 + x * -0.0, x * 0.0], 1.))
+    assert report['merged'] == 2
+    assert np.sum(tape.op == CONST) == 2
+
+def test_optimize_guards():
+    def g(x, y):
+        unused = x * y
+        if x * 2 < y * 2:
+            return [x * 2]
+        return [y * 2]
+    tape, report = optimize_tape(record(g, 1., 3.))
+    assert report['pruned'] == 1
+    assert tape.replay([1., 2.]) and not tape.replay([2., 1.])
+
+def test_ad_optimize():
+    options = [{}, {'replay': True}, {'compile': True}]
+    for option in options:
+        for mode in ('forward', 'reverse'):
+            adobj = AD(f, optimize=True, **option)
+            adobj.set_mode(mode)
+            expected = AD(f, **option)
+            expected.set_mode(mode)
+            for x, y in [(1., 2.), (0.5, 3.)]:
+                assert np.allclose(adobj.grad(x, y), expected.grad(x, y))
+    g = lambda x, y: (x * y + sin(2.) * 3) ** 2 + x * y
+    assert np.allclose(AD(g, optimize=True).hessian(1., 2.), AD(g).hessian(1., 2.))
+    adobj = AD(g, optimize=True, replay=True)
+    adobj.grad(1., 2.)
+    # x * y, and the constants 2. and 2 (values of a scalar tape are floats) are merged
+    assert adobj.optimization == {'folded': 2, 'merged': 2, 'pruned': 2}
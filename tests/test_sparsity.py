@@ -0,0 +1,46 @@
+import pytest
+import numpy as np
+from funkyAD.base import AD, Node
+from funkyAD.functions import sin, floor
+from funkyAD.tape import record
+from funkyAD.sparsity import jacobian_sparsity, hessian_sparsity, color_columns, compression_seed, to_sparse
+
+
+def test_jacobian_sparsity():
+    tape = record(lambda x, y, z: [x * y, sin(z) + 1, floor(x) * 2, Node(3.0)], 1.5, 2.0, 3.0)
+    rows, cols = jacobian_sparsity(tape)
+    assert list(zip(rows, cols)) == [(0, 0), (0, 1), (1, 2), (2, 0)]
+
+def test_jacobian_sparsity_arrays():
+    adobj = AD(lambda x: x * 2, vectorize=True)
+    adobj._record(np.ones(3))
+    with pytest.raises(ValueError):
+        jacobian_sparsity(adobj.tape)
+
+def test_color_columns():
+    # Tridiagonal pattern: 3 colors whatever the size
+    n = 10
+    rows = np.array([r for r in range(n) for c in (r - 1, r, r + 1) if 0 <= c < n])
+    cols = np.array([c for r in range(n) for c in (r - 1, r, r + 1) if 0 <= c < n])
+    colors = color_columns(rows, cols, n)
+    assert colors.max() == 2
+    for r in range(n):
+        in_row = colors[cols[rows == r]]
+        assert len(set(in_row)) == len(in_row)
+
+def test_compression_seed():
+    seed = compression_seed(np.array([0, 1, 0, 2]))
+    assert np.array_equal(seed, [[1, 0, 0], [0, 1, 0], [1, 0, 0], [0, 0, 1]])
+
+def test_to_sparse():
+    pytest.importorskip('scipy')
+    matrix = to_sparse(np.array([1., 2.]), np.array([0, 1]), np.array([1, 0]), (2, 3))
+    assert np.array_equal(matrix.toarray(), [[0, 1, 0], [2, 0, 0]])
+
+def test_hessian_sparsity():
+    tape = record(lambda x, y, z: [x * y + sin(z) + x * 3], 1., 2., 3.)
+    rows, cols = hessian_sparsity(tape)
+    assert list(zip(rows, cols)) == [(0, 1), (1, 0), (2, 2)]
+    # Operations the output does not depend on are not counted
+    tape = record(lambda x, y: [x + y, sin(x * y)][:1], 1., 2.)
+    assert len(hessian_sparsity(tape)[0]) == 0
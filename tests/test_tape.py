@@ -0,0 +1,100 @@
+import pytest
+import numpy as np
+from funkyAD.base import AD, Node
+from funkyAD.functions import addition, multiplication, sin
+from funkyAD.tape import Tape, INPUT, CONST, current_tape, record
+
+
+def test_no_tape_by_default():
+    assert current_tape() is None
+
+def test_record():
+    x, y = Node(2.0), Node(3.0)
+    with Tape() as tape:
+        assert current_tape() is tape
+        z = sin(x * y) + 1
+        tape.record_inputs([x, y])
+        tape.record_outputs([z])
+    tape.finalize()
+    assert current_tape() is None
+    # x*y, sin, constant 1, addition + the two inputs
+    assert len(tape) == 6
+    assert list(tape.op[:2]) == [INPUT, INPUT]
+    assert tape.op[tape.outputs[0]] >= 0
+    assert CONST in tape.op
+    assert tape.values.dtype == np.float64
+    assert tape.values[tape.outputs[0]] == np.sin(6) + 1
+    assert tape.nodes is None
+
+def test_record_function():
+    tape = record(lambda x, y: [sin(x * y) + 1, x], 2.0, 3.0)
+    assert current_tape() is None
+    assert len(tape) == 6
+    assert tape.inputs == [0, 1]
+    assert tape.outputs == [5, 0]
+    assert tape.values[5] == np.sin(6) + 1
+
+def test_record_parents():
+    x = Node(2.0)
+    with Tape() as tape:
+        y = x * x
+        tape.record_inputs([x])
+    tape.finalize()
+    i = y.i
+    assert list(tape.idx[tape.ptr[i]:tape.ptr[i + 1]]) == [x.i, x.i]
+    assert tape.functions[tape.op[i]] is multiplication
+
+def test_reverse_sweep():
+    x, y = Node(2.0), Node(3.0)
+    with Tape() as tape:
+        z = x * y + x
+        tape.record_inputs([x, y])
+        tape.record_outputs([z])
+    tape.finalize()
+    adj = tape.reverse([np.array([1.0])])
+    assert adj.shape == (len(tape), 1)
+    assert adj[tape.inputs[0]] == 4 and adj[tape.inputs[1]] == 2
+
+def test_reverse_uses_tape():
+    adobj = AD(lambda x, y: [x * y, sin(x)])
+    grad = adobj._reverse(1.0, 2.0)
+    assert isinstance(adobj.tape, Tape)
+    assert len(adobj.tape.inputs) == 2 and len(adobj.tape.outputs) == 2
+    assert np.allclose(grad, [[2, 1], [np.cos(1), 0]])
+
+def test_tape_array_values():
+    adobj = AD(lambda a: (a * a).sum(), vectorize=True)
+    grad = adobj._reverse(np.array([1., 2.]))
+    assert not adobj.tape.scalar
+    assert adobj.tape.values.dtype == object
+    assert (grad == [[2, 4]]).all()
+
+def test_replay():
+    x, y = Node(2.0), Node(3.0)
+    with Tape() as tape:
+        z = x * y + 1
+        tape.record_inputs([x, y])
+        tape.record_outputs([z])
+    tape.finalize()
+    assert tape.replay([4.0, 5.0])
+    assert tape.values[tape.outputs[0]] == 21
+
+def test_replay_guard():
+    x, y = Node(2.0), Node(3.0)
+    with Tape() as tape:
+        assert x < y
+        tape.record_inputs([x, y])
+    tape.finalize()
+    assert len(tape.guards) == 1
+    assert tape.replay([1.0, 5.0])
+    assert not tape.replay([5.0, 1.0])
+    # Equal values: comparison is not differentiable, record again
+    assert not tape.replay([1.0, 1.0])
+
+def test_tape_reverse_no_retain():
+    adobj = AD(lambda x, y: [(x * y).sum() + x[0]], vectorize=True)
+    tape = adobj._record(np.array([1., 2.]), np.array([3., 4.]))
+    adj = tape.reverse([np.ones(1)], retain=False)
+    # Only the back-gradients of inputs and constants are left
+    assert all(np.all(adj[i] == 0) for i in range(len(tape)) if tape.op[i] >= 0)
+    assert np.allclose(adj[tape.inputs[0]], [[4, 4]]) and np.allclose(adj[tape.inputs[1]], [[1, 2]])